@@ -0,0 +1,104 @@
+import io, re, threading
+import numpy as np
+from PIL import Image
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import lsbEngine
+
+# Local stand-in for nostr.build. Serves a small set of generated images:
+#   /stego/<i>/<anything>.png   carrier with a hidden message
+#   /plain/<i>/<anything>.png   carrier without a message
+#   /plain/<i>/<anything>.jpg   same carrier as JPEG
+# The trailing name is ignored so every mention can get a unique URL and
+# miss the bot's decode cache.
+
+PATH = re.compile(r"^/(stego|plain)/(\d+)/[^/]+\.(png|jpe?g)$")
+
+def make_carrier(width, height, seed):
+    """Smooth gradient plus noise, compresses roughly like a photo."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.stack([x * 255 // max(width - 1, 1), y * 255 // max(height - 1, 1),
+                     (x + y) * 255 // max(width + height - 2, 1)], axis=-1)
+    noise = rng.integers(-12, 13, size=base.shape)
+    return np.clip(base + noise, 0, 255).astype(np.uint8)
+
+def make_images(count=8, size=(1024, 768), n_bits=2, message="Hello from the benchmark"):
+    """
+    Build the image set served by ImageHost.
+
+    :return: dict mapping (kind, index, ext) to encoded image bytes
+    """
+    images = {}
+    for i in range(count):
+        pixels = make_carrier(size[0], size[1], seed=i)
+        plain = Image.fromarray(pixels)
+        stego = lsbEngine.encode_payload(pixels.copy(), f"{message} #{i}".encode(), n_bits)
+        for kind, image, ext, fmt in (("stego", Image.fromarray(stego), "png", "PNG"),
+                                      ("plain", plain, "png", "PNG"),
+                                      ("plain", plain, "jpg", "JPEG")):
+            buffer = io.BytesIO()
+            image.save(buffer, fmt)
+            images[(kind, i, ext)] = buffer.getvalue()
+    return images
+
+class ImageHost:
+    """
+    Threaded HTTP server for generated images.
+
+    :param images: Output of make_images()
+    :param host: Interface to listen on
+    :param port: Port, 0 picks a free one
+    """
+    def __init__(self, images, host="127.0.0.1", port=0):
+        self.images = images
+        self.count = len({i for _, i, _ in images})
+        self.requests = 0
+        host_ref = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                host_ref.requests += 1
+                match = PATH.match(self.path.split("?")[0])
+                ext = match and ("jpg" if match.group(3).startswith("jp") else "png")
+                body = match and host_ref.images.get((match.group(1), int(match.group(2)), ext))
+                if not body:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "image/jpeg" if ext == "jpg" else "image/png")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # progressive decode hangs up once it has the payload
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def url(self, kind, index, ext, name):
+        return f"{self.base_url}/{kind}/{index % self.count}/{name}.{ext}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+if __name__ == "__main__":
+    host = ImageHost(make_images(), port=8088).start()
+    print(f"Serving images on {host.base_url}/stego/0/x.png")
+    threading.Event().wait()
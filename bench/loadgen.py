@@ -0,0 +1,211 @@
+"""
+End to end load test for bot.py.
+
+Starts a local relay and image host, runs the real bot in a subprocess
+pointed at them, then replays a mention storm and times every mention
+until the bot's encrypted reply shows up on the relay.
+
+    python -m bench.loadgen --mentions 500 --rate 50 --stego-ratio 0.5
+
+Needs the bench requirements (pip install -r bench/requirements.txt).
+"""
+import argparse, asyncio, json, os, subprocess, sys, time
+import urllib.request
+import numpy as np
+from nostr_sdk import Keys, EventBuilder, Tag, nip04_decrypt
+
+from bench.relay import LocalRelay
+from bench.imagehost import ImageHost, make_images
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MESSAGE = "Hello from the benchmark"
+
+def sign(keys, content, tags=()):
+    event = EventBuilder.text_note(content).tags([Tag.parse(tag) for tag in tags]).sign_with_keys(keys)
+    return json.loads(event.as_json())
+
+def classify(text):
+    if text.startswith(MESSAGE):
+        return "decoded"
+    if text.startswith("No secret message"):
+        return "no_message"
+    if text.startswith("I'm decoding a lot"):
+        return "busy"
+    return "error"
+
+def build_storm(args, relay, host, bot_pubkey):
+    """
+    Pre-sign every target note and mention so signing is not timed.
+
+    :return: list of (requester Keys, target event, mention event, expected outcome)
+    """
+    rng = np.random.default_rng(args.seed)
+    author = Keys.generate()
+    storm = []
+    for i in range(args.mentions):
+        roll = rng.random()
+        name = f"m{i}" if not args.reuse_urls else "img"
+        if roll < args.stego_ratio:
+            content, expected = f"look {host.url('stego', i, 'png', name)}", "decoded"
+        elif roll < args.stego_ratio + args.jpeg_ratio:
+            content, expected = f"look {host.url('plain', i, 'jpg', name)}", "no_message"
+        elif roll < args.stego_ratio + args.jpeg_ratio + args.text_ratio:
+            content, expected = f"just text #{i}", "no_message"
+        else:
+            content, expected = f"look {host.url('plain', i, 'png', name)}", "no_message"
+        target = sign(author, content)
+        requester = Keys.generate()
+        mention = sign(requester, "decode this please", [
+            ["e", target["id"], relay.url, "reply"],
+            ["p", bot_pubkey.to_hex()],
+        ])
+        storm.append((requester, target, mention, expected))
+    return storm
+
+def start_bot(args, relay, bot_keys):
+    env = dict(os.environ)
+    env.update({
+        "relaylist": repr([relay.url]),
+        "stegonostrkey": bot_keys.secret_key().to_hex(),
+        "decode_cache_path": args.cache_path,
+        "metrics_port": str(args.metrics_port),
+    })
+    if args.workers:
+        env["decode_workers"] = str(args.workers)
+    log = open(args.bot_log, "w") if args.bot_log else subprocess.DEVNULL
+    return subprocess.Popen([sys.executable, "bot.py"], cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+async def wait_for_subscription(relay, bot_pubkey, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if any(bot_pubkey.to_hex() in f.get("#p", []) for f in relay.subscriptions()):
+            return True
+        await asyncio.sleep(0.1)
+    return False
+
+def report(results, sent, started, finished_at):
+    latencies = np.array([r["latency"] for r in results.values()]) * 1000
+    outcomes = {}
+    for r in results.values():
+        outcomes[r["outcome"]] = outcomes.get(r["outcome"], 0) + 1
+    summary = {
+        "sent": sent,
+        "replied": len(results),
+        "missing": sent - len(results),
+        "outcomes": outcomes,
+        "wrong": sum(1 for r in results.values() if r["outcome"] not in (r["expected"], "busy")),
+        "events_per_second": len(results) / (finished_at - started) if results and finished_at > started else 0.0,
+    }
+    if len(latencies):
+        summary.update({
+            "p50_ms": float(np.percentile(latencies, 50)),
+            "p95_ms": float(np.percentile(latencies, 95)),
+            "p99_ms": float(np.percentile(latencies, 99)),
+            "max_ms": float(latencies.max()),
+        })
+    return summary
+
+async def run(args):
+    relay = await LocalRelay(port=args.relay_port).start()
+    width, height = (int(v) for v in args.size.lower().split("x"))
+    host = ImageHost(make_images(args.images, (width, height), args.n_bits, MESSAGE)).start()
+
+    bot_keys = Keys.generate()
+    bot_pubkey = bot_keys.public_key()
+    bot = start_bot(args, relay, bot_keys)
+    try:
+        if not await wait_for_subscription(relay, bot_pubkey, args.startup_timeout):
+            raise RuntimeError("Bot did not subscribe to the local relay, see --bot-log")
+
+        storm = build_storm(args, relay, host, bot_pubkey)
+        pending = {requester.public_key().to_hex(): (requester, expected) for requester, _, _, expected in storm}
+        sent_at = {}
+        results = {}
+        done = asyncio.Event()
+
+        def on_event(event):
+            if event["kind"] != 4:
+                return
+            for tag in event["tags"]:
+                if tag[0] == "p" and tag[1] in pending and tag[1] in sent_at:
+                    requester, expected = pending.pop(tag[1])
+                    text = nip04_decrypt(requester.secret_key(), bot_pubkey, event["content"])
+                    results[tag[1]] = {
+                        "latency": time.monotonic() - sent_at[tag[1]],
+                        "outcome": classify(text),
+                        "expected": expected,
+                        "at": time.monotonic(),
+                    }
+                    if not pending:
+                        done.set()
+        relay.listeners.append(on_event)
+
+        # Targets are already on the relay when the storm starts, like real notes
+        for _, target, _, _ in storm:
+            await relay.publish(target)
+
+        started = time.monotonic()
+        for i, (requester, _, mention, _) in enumerate(storm):
+            if args.rate:
+                delay = started + i / args.rate - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            sent_at[requester.public_key().to_hex()] = time.monotonic()
+            await relay.publish(mention)
+
+        try:
+            await asyncio.wait_for(done.wait(), args.timeout)
+        except asyncio.TimeoutError:
+            pass
+        finished_at = max((r["at"] for r in results.values()), default=started)
+        summary = report(results, len(storm), started, finished_at)
+        summary["image_requests"] = host.requests
+        if args.metrics_out and args.metrics_port:
+            # Bot side stage histograms, scraped before the bot is stopped
+            with urllib.request.urlopen(f"http://127.0.0.1:{args.metrics_port}/metrics", timeout=5) as response:
+                with open(args.metrics_out, "wb") as f:
+                    f.write(response.read())
+        return summary
+    finally:
+        bot.terminate()
+        try:
+            bot.wait(10)
+        except subprocess.TimeoutExpired:
+            bot.kill()
+        host.stop()
+        await relay.stop()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Mention storm load test for bot.py")
+    parser.add_argument("--mentions", type=int, default=200, help="number of mentions to send")
+    parser.add_argument("--rate", type=float, default=50.0, help="mentions per second, 0 sends them all at once")
+    parser.add_argument("--stego-ratio", type=float, default=0.5, help="share of targets with a stego PNG")
+    parser.add_argument("--jpeg-ratio", type=float, default=0.1, help="share of targets with a plain JPEG")
+    parser.add_argument("--text-ratio", type=float, default=0.1, help="share of targets without an image")
+    parser.add_argument("--reuse-urls", action="store_true", help="reuse image URLs so the decode cache can hit")
+    parser.add_argument("--images", type=int, default=8, help="number of distinct generated carriers")
+    parser.add_argument("--size", default="1024x768", help="carrier size, WxH")
+    parser.add_argument("--n-bits", type=int, default=2)
+    parser.add_argument("--workers", type=int, default=0, help="decode_workers for the bot, 0 keeps its default")
+    parser.add_argument("--cache-path", default="", help="decode_cache_path for the bot, empty keeps it in memory")
+    parser.add_argument("--relay-port", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds to wait for replies after the storm")
+    parser.add_argument("--startup-timeout", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--bot-log", default="", help="write the bot's output here")
+    parser.add_argument("--metrics-port", type=int, default=0, help="metrics_port for the bot, 0 disables it")
+    parser.add_argument("--metrics-out", default="", help="save the bot's /metrics page here after the storm")
+    parser.add_argument("--json", default="", help="also write the summary to this file")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    summary = asyncio.run(run(args))
+    print(json.dumps(summary, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+    return 0 if summary["missing"] == 0 and summary["wrong"] == 0 else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
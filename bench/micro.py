@@ -0,0 +1,239 @@
+"""
+Offline micro-benchmarks for the steganography primitives.
+
+Every case runs on synthetic carriers and payloads, so no network or sample
+images are needed. Results (best time and peak traced memory per case) are
+compared with a JSON baseline and the run fails if any case got slower or
+bigger than the thresholds allow.
+
+    python -m bench.micro --save            # record bench/baseline.json
+    python -m bench.micro                   # compare against it
+    python -m bench.micro --profile full --only "decode_text"
+
+Baselines are machine specific, record one on the machine that compares.
+Peak memory comes from tracemalloc, which sees Python and NumPy buffers but
+not PIL's internal image storage.
+"""
+import argparse, json, os, re, sys, tempfile, time, tracemalloc
+import numpy as np
+from PIL import Image
+
+import lsbEngine
+from lsbSteganography import lsbencode, lsbdecode, encode_text_in_image, decode_text_from_image, \
+    validate_steganography, resize_and_pad
+from emojiDecoder import detect_and_decode_emoji_steganography
+from pngStream import unfilter_scanline
+from scanner import screen
+from bench.imagehost import make_carrier
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+TIME_THRESHOLD = 0.25
+MEMORY_THRESHOLD = 0.25
+# Absolute slack so timer noise on sub-millisecond cases is not a regression
+TIME_SLACK = 0.0005
+MEMORY_SLACK = 64 * 1024
+
+PNG_FILTERS = {1: "sub", 2: "up", 3: "average", 4: "paeth"}
+
+PROFILES = {
+    "quick": {
+        "sizes": [(256, 256), (1024, 768)],
+        "n_bits": [1, 2, 4, 8],
+        "payloads": [10, 1024, 64 * 1024],
+    },
+    "full": {
+        "sizes": [(256, 256), (1024, 768), (4000, 3000), (8000, 6000)],
+        "n_bits": list(range(1, 9)),
+        "payloads": [10, 1024, 100 * 1024, 4 * 1024 * 1024],
+    },
+}
+
+def label_size(size):
+    return f"{size[0]}x{size[1]}"
+
+def label_bytes(count):
+    for unit, scale in (("MB", 1024 * 1024), ("KB", 1024)):
+        if count >= scale:
+            return f"{count // scale}{unit}"
+    return f"{count}B"
+
+def make_text(count, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.integers(ord("a"), ord("z") + 1, size=count, dtype=np.uint8).tobytes().decode()
+
+def hide_in_emoji(payload):
+    """Append payload bytes to an emoji as variation selectors."""
+    return "\U0001F642" + "".join(chr(0xFE00 + b) if b < 16 else chr(0xE0100 + b - 16) for b in payload)
+
+class Case:
+    """
+    One benchmark.
+
+    :param name: Unique key, used in the baseline
+    :param func: Function being measured
+    :param args: Callable returning fresh arguments for one call, not timed
+    """
+    def __init__(self, name, func, args):
+        self.name = name
+        self.func = func
+        self.args = args
+
+def build_cases(profile, workdir):
+    cases = []
+    carriers = {}
+
+    def carrier(size):
+        if size not in carriers:
+            carriers[size] = make_carrier(size[0], size[1], seed=1)
+        return carriers[size]
+
+    def saved(pixels, name):
+        path = os.path.join(workdir, name)
+        if not os.path.exists(path):
+            Image.fromarray(pixels).save(path, compress_level=1)
+        return path
+
+    for size in profile["sizes"]:
+        pixels = carrier(size)
+        size_label = label_size(size)
+        plain_path = saved(pixels, f"plain-{size_label}.png")
+        plain = Image.fromarray(pixels)
+        secret = Image.fromarray(make_carrier(size[0], size[1], seed=2))
+
+        # Different aspect ratio so there is padding, thumbnail() works in place
+        target = (size[0] // 2, size[1] * 2 // 3)
+        cases.append(Case(f"resize_and_pad[{size_label}]", resize_and_pad,
+                          lambda pixels=pixels, target=target: (Image.fromarray(pixels), target)))
+
+        # One RGB scanline per PNG filter, what the progressive decoder pays per row
+        row, prior = pixels[1].reshape(-1), pixels[0].reshape(-1)
+        for filter_type, filter_name in PNG_FILTERS.items():
+            cases.append(Case(f"unfilter_scanline[{size[0]}px,{filter_name}]", unfilter_scanline,
+                              lambda f=filter_type, row=row, prior=prior: (f, row, prior, 3)))
+
+        for n_bits in profile["n_bits"]:
+            cases.append(Case(f"lsbencode[{size_label},n{n_bits}]", lsbencode,
+                              lambda secret=secret, plain=plain, n=n_bits: (secret, plain, n)))
+            cases.append(Case(f"lsbdecode[{size_label},n{n_bits}]", lsbdecode,
+                              lambda plain=plain, n=n_bits: (plain, n)))
+
+            room = (lsbEngine.capacity(pixels, n_bits) - lsbEngine.FRAME_PREFIX_BITS) // 8
+            for payload in profile["payloads"]:
+                if payload > room:
+                    continue
+                key = f"{size_label},n{n_bits},{label_bytes(payload)}"
+                text = make_text(payload)
+                stego = lsbEngine.encode_payload(pixels.copy(), text.encode(), n_bits)
+                stego_path = saved(stego, f"stego-{size_label}-{n_bits}-{payload}.png")
+                stego_image = Image.fromarray(stego)
+
+                cases.append(Case(f"encode_text_in_image[{key}]", encode_text_in_image,
+                                  lambda path=plain_path, text=text, n=n_bits: (path, text, n)))
+                cases.append(Case(f"decode_text_from_image[{key}]", decode_text_from_image,
+                                  lambda path=stego_path, n=n_bits: (path, n)))
+                cases.append(Case(f"decode_text_from_image_progressive[{key}]", decode_text_from_image,
+                                  lambda path=stego_path, n=n_bits: (path, n, True)))
+                cases.append(Case(f"validate_steganography[{key}]", validate_steganography,
+                                  lambda image=stego_image, n=n_bits: (image, n)))
+
+    for payload in profile["payloads"]:
+        text = "gm " + hide_in_emoji(make_text(payload).encode()) + " gn"
+        cases.append(Case(f"detect_and_decode_emoji_steganography[{label_bytes(payload)}]",
+                          detect_and_decode_emoji_steganography, lambda text=text: (text,)))
+        cases.append(Case(f"scanner_screen[{label_bytes(payload)}]", screen, lambda text=text: (text,)))
+    return cases
+
+def measure(case, min_time=0.2, max_repeat=20, memory=True):
+    """
+    Time a case and trace its peak allocation.
+
+    :return: dict with best and median seconds, runs and peak_bytes
+    """
+    times = []
+    while len(times) < max_repeat and (not times or sum(times) < min_time):
+        args = case.args()
+        started = time.perf_counter()
+        case.func(*args)
+        times.append(time.perf_counter() - started)
+    result = {"seconds": min(times), "median_seconds": float(np.median(times)), "runs": len(times)}
+    if memory:
+        # Separate run, tracing slows allocation heavy code down
+        args = case.args()
+        tracemalloc.start()
+        try:
+            case.func(*args)
+            result["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result
+
+def compare(results, baseline, time_threshold=TIME_THRESHOLD, memory_threshold=MEMORY_THRESHOLD):
+    """
+    :return: list of regression messages, empty if every case is within bounds
+    """
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        if result["seconds"] > before["seconds"] * (1 + time_threshold) + TIME_SLACK:
+            regressions.append(f"{name}: {before['seconds'] * 1000:.2f} ms -> {result['seconds'] * 1000:.2f} ms")
+        if "peak_bytes" in result and "peak_bytes" in before \
+                and result["peak_bytes"] > before["peak_bytes"] * (1 + memory_threshold) + MEMORY_SLACK:
+            regressions.append(f"{name}: peak {before['peak_bytes']} -> {result['peak_bytes']} bytes")
+    return regressions
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the steganography primitives")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="quick")
+    parser.add_argument("--only", default="", help="regex, run only matching cases")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save", action="store_true", help="write results as the new baseline")
+    parser.add_argument("--time-threshold", type=float, default=TIME_THRESHOLD, help="allowed slowdown, 0.25 = 25%%")
+    parser.add_argument("--memory-threshold", type=float, default=MEMORY_THRESHOLD, help="allowed peak memory growth")
+    parser.add_argument("--min-time", type=float, default=0.2, help="keep repeating a case for this many seconds")
+    parser.add_argument("--no-memory", action="store_true", help="skip the traced memory run")
+    parser.add_argument("--output", default="", help="also write this run's results here")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    only = re.compile(args.only) if args.only else None
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for case in build_cases(PROFILES[args.profile], workdir):
+            if only and not only.search(case.name):
+                continue
+            result = measure(case, args.min_time, memory=not args.no_memory)
+            results[case.name] = result
+            peak = f"{result['peak_bytes'] / 1024 / 1024:9.2f} MB" if "peak_bytes" in result else ""
+            print(f"{case.name:70s} {result['seconds'] * 1000:10.3f} ms {peak}", flush=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.save:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, run with --save first")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.time_threshold, args.memory_threshold)
+    for message in regressions:
+        print(f"REGRESSION {message}")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+"""
+Precision and recall of the steganalysis pre-filter.
+
+Scores a labelled corpus with the same statistics the decoders use to skip
+clean images, then reports how each confidence threshold would split it.
+A corpus is a directory with stego/ and clean/ subdirectories of images;
+without one a synthetic corpus is generated.
+
+    python -m bench.prefilter                        # synthetic corpus
+    python -m bench.prefilter --corpus ~/stegcorpus  # labelled images
+    python -m bench.prefilter --thresholds 0.1,0.2,0.25,0.3
+
+Pick a threshold and set it with the prefilter_threshold environment
+variable. Lower thresholds keep recall on lightly embedded images, higher
+ones skip more clean images before extraction.
+"""
+import argparse, io, json, os, sys, time
+import numpy as np
+from PIL import Image, ImageFilter
+
+import lsbEngine
+import steganalysis
+
+THRESHOLDS = (0.05, 0.1, 0.15, 0.2, 0.25, 0.3, 0.35, 0.4, 0.5, 0.6, 0.8)
+WORDS = "the quick brown fox jumps over a lazy dog while nostr relays hum along".split()
+
+def make_photo(width, height, seed):
+    """
+    Blurred colour blobs with mild sensor-like noise. RS analysis relies on
+    neighbouring pixels being correlated, which bench.imagehost's heavily
+    noised gradients are not.
+    """
+    rng = np.random.default_rng(seed)
+    small = rng.integers(0, 256, (max(height // 32, 2), max(width // 32, 2), 3), dtype=np.uint8)
+    image = Image.fromarray(small).resize((width, height), Image.BICUBIC).filter(ImageFilter.GaussianBlur(2))
+    noise = rng.integers(-3, 4, (height, width, 3))
+    return np.clip(np.asarray(image).astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+def region(pixels, values=steganalysis.MAX_SAMPLE):
+    """First rows of the image holding about values channel values, what looks_embedded() tests."""
+    rows = -(-values // (pixels.shape[1] * pixels.shape[2]))
+    return pixels[:rows]
+
+def synthetic_corpus(count, size, n_bits, seed=0):
+    """
+    Yield (label, name, pixels, depths) for generated carriers.
+
+    Stego images carry a legacy message long enough to fill the tested
+    region at every depth in n_bits and are scored at their own depth.
+    Clean images are the untouched carrier as PNG and as JPEG, scored at
+    every depth since a bogus header can claim any of them.
+    """
+    rng = np.random.default_rng(seed)
+    for i in range(count):
+        pixels = make_photo(size[0], size[1], seed=seed + i)
+        yield "clean", f"plain{i}.png", pixels, n_bits
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).save(buffer, "JPEG", quality=int(rng.integers(70, 96)))
+        yield "clean", f"plain{i}.jpg", np.asarray(Image.open(buffer).convert("RGB")), n_bits
+        for n in n_bits:
+            length = steganalysis.MAX_SAMPLE * n // 8
+            text = " ".join(rng.choice(WORDS, length // 4)).encode()[:length]
+            stego = lsbEngine.encode_payload(pixels.copy(), text, n, version=1)
+            yield "stego", f"stego{i}_n{n}.png", stego, [n]
+
+def corpus_from_dir(path, n_bits):
+    for label in ("stego", "clean"):
+        directory = os.path.join(path, label)
+        for name in sorted(os.listdir(directory)):
+            try:
+                pixels = lsbEngine.image_to_array(os.path.join(directory, name))
+            except Exception as e:
+                print(f"skipping {label}/{name}: {e}", file=sys.stderr)
+                continue
+            yield label, name, pixels, n_bits
+
+def score(corpus):
+    """
+    Score each image at each of its depths and keep the highest confidence.
+
+    :return: list of dicts with label, name, confidence and ms per depth
+    """
+    scores = []
+    for label, name, pixels, depths in corpus:
+        started = time.perf_counter()
+        analysis = max((steganalysis.stego_confidence(region(pixels), n_bits=n) for n in depths),
+                       key=lambda analysis: analysis.confidence)
+        scores.append({
+            "label": label,
+            "name": name,
+            "confidence": analysis.confidence,
+            "chi_square_p": analysis.chi_square_p,
+            "rs_rate": analysis.rs_rate,
+            "ms": (time.perf_counter() - started) * 1000 / len(depths),
+        })
+    return scores
+
+def sweep(scores, thresholds):
+    rows = []
+    for threshold in thresholds:
+        flagged = [s for s in scores if s["confidence"] >= threshold]
+        true_positives = sum(1 for s in flagged if s["label"] == "stego")
+        positives = sum(1 for s in scores if s["label"] == "stego")
+        negatives = len(scores) - positives
+        rows.append({
+            "threshold": threshold,
+            "precision": true_positives / len(flagged) if flagged else 1.0,
+            "recall": true_positives / positives if positives else 1.0,
+            # Share of clean images the decoders would skip at this threshold
+            "clean_skipped": (negatives - (len(flagged) - true_positives)) / negatives if negatives else 0.0,
+        })
+    return rows
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Precision/recall of the steganalysis pre-filter")
+    parser.add_argument("--corpus", default="", help="directory with stego/ and clean/ subdirectories")
+    parser.add_argument("--count", type=int, default=20, help="synthetic carriers to generate")
+    parser.add_argument("--size", default="640x480", help="synthetic carrier size, WxH")
+    parser.add_argument("--n-bits", default="1,2,4", help="depths to embed at and to score clean images at")
+    parser.add_argument("--thresholds", default=",".join(map(str, THRESHOLDS)))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="print every image's score")
+    parser.add_argument("--json", default="", help="also write scores and the sweep to this file")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    n_bits = [int(n) for n in args.n_bits.split(",")]
+    if args.corpus:
+        corpus = corpus_from_dir(args.corpus, n_bits)
+    else:
+        width, height = (int(v) for v in args.size.lower().split("x"))
+        corpus = synthetic_corpus(args.count, (width, height), n_bits, args.seed)
+    scores = score(corpus)
+    rows = sweep(scores, [float(t) for t in args.thresholds.split(",")])
+
+    if args.verbose:
+        for s in scores:
+            print(f"{s['label']:5} {s['confidence']:.3f}  chi {s['chi_square_p']:.3f}  rs {s['rs_rate']:.3f}  {s['name']}")
+    times = np.array([s["ms"] for s in scores])
+    print(f"{len(scores)} images, median {np.median(times):.2f} ms, max {times.max():.2f} ms per depth scored")
+    print(f"{'threshold':>9} {'precision':>9} {'recall':>7} {'clean skipped':>13}")
+    for row in rows:
+        marker = " <- prefilter_threshold" if abs(row["threshold"] - steganalysis.PREFILTER_THRESHOLD) < 1e-9 else ""
+        print(f"{row['threshold']:9.2f} {row['precision']:9.3f} {row['recall']:7.3f} {row['clean_skipped']:13.3f}{marker}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"scores": scores, "sweep": rows}, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
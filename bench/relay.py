@@ -0,0 +1,116 @@
+import asyncio, json, logging
+from websockets.asyncio.server import serve
+from websockets.exceptions import ConnectionClosed
+
+# Local stand-in for a nostr relay, just enough NIP-01 for the bot:
+# EVENT (stored and broadcast, answered with OK), REQ (stored matches, EOSE,
+# then live events) and CLOSE. Events are not verified, the bot verifies
+# what it looks up itself.
+
+def matches(f, event):
+    """Check an event (dict) against one NIP-01 filter (dict)."""
+    if "ids" in f and event["id"] not in f["ids"]:
+        return False
+    if "authors" in f and event["pubkey"] not in f["authors"]:
+        return False
+    if "kinds" in f and event["kind"] not in f["kinds"]:
+        return False
+    if "since" in f and event["created_at"] < f["since"]:
+        return False
+    if "until" in f and event["created_at"] > f["until"]:
+        return False
+    for key, values in f.items():
+        if key.startswith("#") and len(key) == 2:
+            tagged = {tag[1] for tag in event["tags"] if len(tag) >= 2 and tag[0] == key[1]}
+            if not tagged.intersection(values):
+                return False
+    return True
+
+class LocalRelay:
+    """
+    In-memory websocket relay.
+
+    :param host: Interface to listen on
+    :param port: Port, 0 picks a free one
+    """
+    def __init__(self, host="127.0.0.1", port=0):
+        self.host = host
+        self.port = port
+        self.events = {}
+        self.listeners = []
+        self._subs = {}
+        self._server = None
+
+    @property
+    def url(self):
+        return f"ws://{self.host}:{self.port}"
+
+    async def start(self):
+        self._server = await serve(self._handle, self.host, self.port, max_size=None)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def subscriptions(self):
+        """All live filters, across connections."""
+        return [f for subs in self._subs.values() for filters in subs.values() for f in filters]
+
+    async def publish(self, event):
+        """Store an event (dict) and push it to matching subscriptions."""
+        if event["id"] in self.events:
+            return
+        self.events[event["id"]] = event
+        for listener in self.listeners:
+            listener(event)
+        for connection, subs in list(self._subs.items()):
+            for sub_id, filters in list(subs.items()):
+                if any(matches(f, event) for f in filters):
+                    try:
+                        await connection.send(json.dumps(["EVENT", sub_id, event]))
+                    except ConnectionClosed:
+                        break
+
+    async def _handle(self, connection):
+        subs = self._subs[connection] = {}
+        try:
+            async for raw in connection:
+                try:
+                    message = json.loads(raw)
+                except ValueError:
+                    await connection.send(json.dumps(["NOTICE", "invalid: not json"]))
+                    continue
+                if message[0] == "EVENT":
+                    event = message[1]
+                    await connection.send(json.dumps(["OK", event["id"], True, ""]))
+                    await self.publish(event)
+                elif message[0] == "REQ":
+                    sub_id, filters = message[1], message[2:]
+                    subs[sub_id] = filters
+                    for f in filters:
+                        found = [event for event in self.events.values() if matches(f, event)]
+                        found.sort(key=lambda event: event["created_at"], reverse=True)
+                        if "limit" in f:
+                            found = found[:f["limit"]]
+                        for event in found:
+                            await connection.send(json.dumps(["EVENT", sub_id, event]))
+                    await connection.send(json.dumps(["EOSE", sub_id]))
+                elif message[0] == "CLOSE":
+                    subs.pop(message[1], None)
+        except ConnectionClosed:
+            pass
+        except Exception as e:
+            logging.error(f"Local relay error: {str(e)}")
+        finally:
+            self._subs.pop(connection, None)
+
+if __name__ == "__main__":
+    async def run():
+        relay = await LocalRelay(port=7777).start()
+        print(f"Relay listening on {relay.url}")
+        await asyncio.Future()
+    asyncio.run(run())
@@ -0,0 +1,167 @@
+import numpy as np
+
+def pack_symbols(symbols, n_bits):
+    """
+    Concatenate n_bits wide values (MSB first) into bytes.
+    The final byte is padded with zeros on the right.
+
+    :param symbols: uint8 numpy array of values below 2**n_bits
+    :param n_bits: Width of each value in bits (1-8)
+    :return: bytes
+    """
+    symbols = np.asarray(symbols, dtype=np.uint8)
+    if n_bits == 8:
+        return symbols.tobytes()
+    per_byte = 8 // n_bits
+    if 8 % n_bits == 0 and len(symbols) % per_byte == 0:
+        # Whole symbols per byte, combine them without expanding to bits
+        shifts = np.arange(8 - n_bits, -1, -n_bits, dtype=np.uint8)
+        return np.bitwise_or.reduce(symbols.reshape(-1, per_byte) << shifts, axis=1).astype(np.uint8).tobytes()
+    bits = np.unpackbits(symbols[:, None], axis=1)[:, 8 - n_bits:]
+    return np.packbits(bits.reshape(-1)).tobytes()
+
+def unpack_symbols(data, n_bits, count=None):
+    """
+    Split bytes into n_bits wide values (MSB first), the inverse of pack_symbols.
+    A short final value is padded with zeros on the right.
+
+    :param data: bytes-like object
+    :param n_bits: Width of each value in bits (1-8)
+    :param count: Number of values to return (default: all that data covers)
+    :return: uint8 numpy array
+    """
+    data = np.frombuffer(data, dtype=np.uint8)
+    if count is None:
+        count = -(-len(data) * 8 // n_bits)
+    if n_bits == 8:
+        return data[:count].copy()
+    if 8 % n_bits == 0:
+        shifts = np.arange(8 - n_bits, -1, -n_bits, dtype=np.uint8)
+        mask = np.uint8((1 << n_bits) - 1)
+        return ((data[:, None] >> shifts) & mask).reshape(-1)[:count]
+    bits = np.unpackbits(data)
+    pad = -len(bits) % n_bits
+    if pad:
+        bits = np.concatenate([bits, np.zeros(pad, dtype=np.uint8)])
+    weights = (1 << np.arange(n_bits - 1, -1, -1)).astype(np.uint8)
+    return (bits.reshape(-1, n_bits) * weights).sum(axis=1, dtype=np.uint8)[:count]
+
+class BitWriter:
+    """
+    Accumulates a bitstream MSB first into a bytearray.
+    """
+    def __init__(self):
+        self._buffer = bytearray()
+        self._acc = 0
+        self._acc_bits = 0
+
+    def __len__(self):
+        """Number of bits written so far."""
+        return len(self._buffer) * 8 + self._acc_bits
+
+    def write(self, value, width):
+        """Append the low width bits of an integer."""
+        self._acc = (self._acc << width) | (value & ((1 << width) - 1))
+        self._acc_bits += width
+        spill = self._acc_bits % 8
+        if self._acc_bits >= 8:
+            self._buffer += (self._acc >> spill).to_bytes(self._acc_bits // 8, "big")
+            self._acc &= (1 << spill) - 1
+            self._acc_bits = spill
+
+    def write_bytes(self, data):
+        """Append whole bytes. Byte aligned writes are a plain buffer extend."""
+        if self._acc_bits == 0:
+            self._buffer += data
+        else:
+            self._write_bits(np.unpackbits(np.frombuffer(data, dtype=np.uint8)))
+
+    def write_symbols(self, symbols, n_bits):
+        """Append n_bits wide values, e.g. channel values read from an image."""
+        symbols = np.asarray(symbols, dtype=np.uint8)
+        if self._acc_bits == 0 and (len(symbols) * n_bits) % 8 == 0:
+            self._buffer += pack_symbols(symbols, n_bits)
+        else:
+            self._write_bits(np.unpackbits(symbols[:, None], axis=1)[:, 8 - n_bits:].reshape(-1))
+
+    def _write_bits(self, bits):
+        if self._acc_bits:
+            pending = np.unpackbits(np.array([self._acc], dtype=np.uint8))[8 - self._acc_bits:]
+            bits = np.concatenate([pending, bits])
+        whole = len(bits) // 8 * 8
+        self._buffer += np.packbits(bits[:whole]).tobytes()
+        self._acc = 0
+        self._acc_bits = len(bits) - whole
+        for bit in bits[whole:]:
+            self._acc = (self._acc << 1) | int(bit)
+
+    def getvalue(self):
+        """Return the bitstream as bytes, zero padding the last partial byte."""
+        if self._acc_bits:
+            return bytes(self._buffer) + bytes([self._acc << (8 - self._acc_bits)])
+        return bytes(self._buffer)
+
+class BitReader:
+    """
+    Reads a bitstream MSB first from a bytes-like object without copying it.
+    """
+    def __init__(self, data, bit_length=None):
+        self._data = memoryview(data).cast("B")
+        self._bit_length = len(self._data) * 8 if bit_length is None else bit_length
+        self._pos = 0
+
+    @property
+    def position(self):
+        return self._pos
+
+    def remaining(self):
+        """Number of unread bits."""
+        return self._bit_length - self._pos
+
+    def _require(self, width):
+        if width > self.remaining():
+            raise EOFError(f"Bitstream exhausted: wanted {width} bits, {self.remaining()} left")
+
+    def skip(self, width):
+        self._require(width)
+        self._pos += width
+
+    def read(self, width):
+        """Read width bits as an unsigned integer."""
+        self._require(width)
+        start, end = self._pos // 8, -(-(self._pos + width) // 8)
+        chunk = int.from_bytes(self._data[start:end], "big")
+        tail = end * 8 - (self._pos + width)
+        self._pos += width
+        return (chunk >> tail) & ((1 << width) - 1)
+
+    def read_bytes(self, count):
+        """Read count whole bytes. Byte aligned reads are a memoryview slice."""
+        self._require(count * 8)
+        start = self._pos // 8
+        if self._pos % 8 == 0:
+            self._pos += count * 8
+            return self._data[start:start + count].tobytes()
+        offset = self._pos % 8
+        bits = np.unpackbits(np.frombuffer(self._data[start:start + count + 1], dtype=np.uint8))
+        self._pos += count * 8
+        return np.packbits(bits[offset:offset + count * 8]).tobytes()
+
+    def read_symbols(self, n_bits, count=None):
+        """Read n_bits wide values for embedding, by default the rest of the stream."""
+        if count is None:
+            count = -(-self.remaining() // n_bits)
+        width = min(count * n_bits, self.remaining())
+        start, offset = self._pos // 8, self._pos % 8
+        data = self._data[start:-(-(self._pos + width) // 8)]
+        self._pos += width
+        if offset == 0:
+            symbols = unpack_symbols(data, n_bits, count)
+        else:
+            bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8))[offset:offset + width]
+            symbols = unpack_symbols(np.packbits(bits).tobytes(), n_bits, count)
+        spare = count * n_bits - width
+        if 0 < spare < n_bits:
+            # Clear bits past the declared end of the stream
+            symbols[-1] &= np.uint8(0xFF << spare & 0xFF)
+        return symbols
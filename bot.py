@@ -5,14 +5,20 @@ logging.basicConfig(level=logging.INFO)
 # Internal programs
 # from nostr.publish import nostrpost
 from nostr.getevent import getevent
-from lsbSteganography import decode_text_from_url, extract_image_url
-from emojiDecoder import detect_and_decode_emoji_steganography
+from nostr.pool import pool as relay_pool, LOOKUP_TIMEOUT
+from nostr.outbox import Outbox, Reply, NIP04, NIP17
+from lsbSteganography import extract_images
+from workerPool import DecodePool, JobGroup, OVERFLOWED, lsb_job, emoji_job
+from decodeCache import DecodeCache
+from eventDedup import SeenEvents, SingleFlight
+from metrics import registry, stage, start_server, SamplingProfiler, PROFILE_INTERVAL
+from scanner import Scanner, FindingsIndex, SCAN_FIREHOSE, FIREHOSE_SUBSCRIPTION
 
 # Outside programs
-import asyncio, os, json, ast, re
+import asyncio, os, json, ast, re, time
 from nostr_sdk import Client, PublicKey, NostrSigner, Keys, Event, UnsignedEvent, Filter, \
-    HandleNotification, Timestamp, nip04_decrypt, ClientMessage, EventBuilder, UnwrappedGift, \
-    init_logger, LogLevel, Kind, Tag, nip04_encrypt
+    HandleNotification, Timestamp, nip04_decrypt, ClientMessage, UnwrappedGift, \
+    init_logger, LogLevel, Kind
 
 # Set Contact and Private Key
 lemon = "npub1hee433872q2gen90cqh2ypwcq9z7y5ugn23etrd2l2rrwpruss8qwmrsv6"
@@ -37,6 +43,27 @@ Tag me in the reply to the image you want decoded\n\n
                     
 Send any feeedback you have to nostr:{lemon}
 '''
+busy_message = "I'm decoding a lot of images right now, please tag me again in a few minutes"
+no_message = 'No secret message detected'
+# Bounds the flight leader's lookup, waiters get the not-found reply when it
+# runs out. The batched lookup itself gives up after LOOKUP_TIMEOUT, this
+# also covers connecting to a hinted relay.
+GETEVENT_TIMEOUT = LOOKUP_TIMEOUT.total_seconds() + 5
+
+def describe_result(result):
+    if result is OVERFLOWED:
+        return busy_message
+    return result if result else no_message
+
+def combine_results(results):
+    """One reply for every image in a note, numbered when there are several."""
+    if len(results) == 1:
+        return describe_result(results[0])
+    if all(result is OVERFLOWED for result in results):
+        return busy_message
+    if not any(result and result is not OVERFLOWED for result in results):
+        return no_message
+    return "\n\n".join(f"Image {i}/{len(results)}: {describe_result(result)}" for i, result in enumerate(results, 1))
 
 async def main():
     init_logger(LogLevel.DEBUG)
@@ -53,6 +80,47 @@ async def main():
         await client.add_relay(relay)
     await client.connect()
 
+    # Open lookup connections now so the first mention skips the handshakes
+    await relay_pool.client()
+
+    # Replies are encrypted and published in the background, handlers never wait on relay acks
+    outbox = Outbox(client, keys)
+    outbox.start()
+
+    decode_pool = DecodePool()
+    decode_pool.start()
+    decode_cache = DecodeCache()
+    seen_events = SeenEvents()
+    decode_flights = SingleFlight()
+    scanner = Scanner(decode_pool, decode_cache, FindingsIndex()) if SCAN_FIREHOSE else None
+
+    # Metrics endpoint, gauges are read when scraped
+    events_total = registry.counter("stegbot_events_total", "Events received, by kind")
+    duplicates_total = registry.counter("stegbot_duplicate_events_total", "Extra copies of already handled events")
+    replies_total = registry.counter("stegbot_replies_total", "Direct messages sent")
+    reply_seconds = registry.histogram("stegbot_reply_seconds", "Time from receiving a mention to sending its reply")
+    registry.gauge("stegbot_decode_queue_depth", "Decode jobs waiting for a worker", decode_pool.qsize)
+    registry.gauge("stegbot_outbox_depth", "Replies waiting to be sent", outbox.qsize)
+    registry.gauge("stegbot_outbox_inflight", "Replies being published", lambda: outbox.inflight)
+    registry.gauge("stegbot_decode_inflight", "Targets being decoded", lambda: len(decode_flights))
+    registry.gauge("stegbot_decode_cache_hit_ratio", "Decode cache hits over lookups", decode_cache.hit_ratio)
+    registry.gauge("stegbot_decode_cache_hits", "Decode cache hits since start", lambda: decode_cache.hits)
+    registry.gauge("stegbot_decode_cache_misses", "Decode cache misses since start", lambda: decode_cache.misses)
+    registry.gauge("stegbot_relay_consecutive_failures", "Failed lookups in a row per relay",
+                   lambda: [({"relay": url}, h.consecutive_failures) for url, h in relay_pool.health.items()])
+    registry.gauge("stegbot_relay_latency_seconds", "Moving average lookup latency per relay",
+                   lambda: [({"relay": url}, h.latency) for url, h in relay_pool.health.items() if h.latency is not None])
+    profiler = SamplingProfiler(PROFILE_INTERVAL).start() if PROFILE_INTERVAL else None
+
+    def send_dm(receiver, message, protocol=NIP04, received_at=None):
+        """Queue a direct message, counted once a relay accepts it."""
+        async def sent(reply):
+            replies_total.inc()
+            if received_at is not None:
+                reply_seconds.observe(time.perf_counter() - received_at)
+        outbox.put(Reply(receiver, message, protocol, sent))
+    start_server(profiler=profiler)
+
     now = Timestamp.now()
 
     # nip04_filter = Filter().pubkey(pk).kind(Kind.from_enum(KindEnum.ENCRYPTED_DIRECT_MESSAGE())).since(now)
@@ -63,9 +131,25 @@ async def main():
     nip59_filter = Filter().pubkey(pk).kind(Kind(14)).limit(0)
     # await client.subscribe([nip04_filter, nip59_filter, mentions], None)
     await client.subscribe(mentions, None)
+    if scanner:
+        # Every new note, screened by the scanner and never answered
+        await client.subscribe_with_id(FIREHOSE_SUBSCRIPTION, Filter().kind(Kind(1)).since(now), None)
 
     class NotificationHandler(HandleNotification):
         async def handle(self, relay_url, subscription_id, event: Event):
+            received_at = time.perf_counter()
+            # Firehose notes skip the mention path, mentions also arrive on their own subscription
+            if subscription_id == FIREHOSE_SUBSCRIPTION:
+                content = event.content()
+                # Tags only matter for notes that link something, skip converting them otherwise
+                tags = [tag.as_vec() for tag in event.tags().to_vec()] if "://" in content else ()
+                scanner.handle(event.id().to_hex(), event.author().to_hex(), event.created_at().as_secs(), content, tags)
+                return "Scanned"
+            # The same event arrives once per relay, only handle the first copy
+            if not seen_events.add(event.id().to_hex()):
+                duplicates_total.inc()
+                return "Duplicate event"
+            events_total.inc(kind=event.kind().as_u16())
             logging.info(f"Received new event from {relay_url}: {event.as_json()}")
             # if event.kind().as_enum() == KindEnum.ENCRYPTED_DIRECT_MESSAGE():
             if event.kind().as_u16() == 4: #Encrypted direct message
@@ -76,9 +160,7 @@ async def main():
                     # secret = await make_private_msg(keys, event.author(), help_message)
                     # await client.send_event(secret)
                     # await client.send_direct_msg(event.author(), help_message, None)
-                    encrypted_content = nip04_encrypt(sk, event.author(), help_message)
-                    builder = EventBuilder(Kind(4), encrypted_content).tag(Tag.public_key(event.author()))
-                    await client.send_event_builder(builder)
+                    send_dm(event.author(), help_message)
                     logging.info(f"Received new msg: {msg}")
                 except Exception as e:
                     logging.info(f"Error during content NIP04 decryption: {e}")
@@ -97,7 +179,7 @@ async def main():
                         if rumor.kind().as_u16() == 14: #Private message
                             msg = rumor.content()
                             logging.info(f"Received new msg [sealed]: {msg}")
-                            await client.send_private_msg(sender, help_message, None)
+                            send_dm(sender, help_message, NIP17)
                         else:
                             logging.info(f"{rumor.as_json()}")
                 except Exception as e:
@@ -121,7 +203,12 @@ async def main():
                     logging.info('Self referenced event')
                     return "Self referenced event"
                 
+                # Replies to every requester of the same target go through the decode flight
+                async def send_reply(message):
+                    send_dm(receiver, message, received_at=received_at)
+
                 # New Event!
+                leader = False
                 try:
                     logging.info('New event!')
                     # Extract target event ID                 
@@ -145,9 +232,16 @@ async def main():
                                 relay_hint = tag[2] if len(tag) >= 3 else None
                                 break
 
+                    # Someone else already asked for this target, wait for their result
+                    if not decode_flights.join(target_eventID, send_reply):
+                        logging.info(f"Joined in-flight decode: {target_eventID}")
+                        return "Joined in-flight decode"
+                    leader = True
+
                     # Get target event
                     try:
-                        target_event = await getevent(id=target_eventID, relay=relay_hint)
+                        with stage("getevent"):
+                            target_event = await asyncio.wait_for(getevent(id=target_eventID, relay=relay_hint), GETEVENT_TIMEOUT)
                         target_event = target_event[0]
                         logging.info("Target Content:")
                         logging.info(str(target_event))
@@ -155,81 +249,57 @@ async def main():
                     except:
                         logging.info(f"Event Detection Issue: {target_eventID}")
                         message = 'Uh-oh! Unable to find event in relay list'
-                        # await nostrpost(private_key=private_key, content=message, reply_to=eventID)
-                        # await client.send_private_msg(receiver=receiver, message=message, reply_to=None)
-                        # secret = await make_private_msg(keys, event.author(), message)
-                        # await client.send_event(secret)
-                        # await client.send_direct_msg(receiver, message, reply)
-                        encrypted_content = nip04_encrypt(sk, receiver, message)
-                        builder = EventBuilder(Kind(4), encrypted_content).tags([Tag.public_key(receiver)])
-                        await client.send_event_builder(builder)
+                        await decode_flights.resolve(target_eventID, message)
 
                         return "Consider adding new relays"
 
                     # Search for target language and source language
                     logging.info("Event Content:")
                     logging.info(str(target_event['content']))
-                    encoded_url = extract_image_url(str(target_event['content']))
-
-                    if encoded_url:
-                        logging.info("Extracted Encoded URL:")
-                        logging.info(encoded_url)
-                        decoded_text = decode_text_from_url(encoded_url)
-                        logging.info("Decoded Text:")
-                        logging.info(decoded_text)
-                        if decoded_text:
-                            # await nostrpost(private_key=private_key, content=decoded_text, reply_to=eventID)
-                            # await client.send_private_msg(receiver=receiver, message=decoded_text, reply_to=None)
-                            # secret = await make_private_msg(keys, event.author(), decoded_text)
-                            # await client.send_event(secret)
-                            # await client.send_direct_msg(receiver, decoded_text, reply)
-                            encrypted_content = nip04_encrypt(sk, receiver, decoded_text)
-                            builder = EventBuilder(Kind(4), encrypted_content).tags([Tag.public_key(receiver)])
-                            await client.send_event_builder(builder)
-                            return "Successful Decoding!"
-                        else:
-                            logging.info(f"No secret message detected: {target_eventID}")
-                            message = 'No secret message detected'
-                            # await nostrpost(private_key=message, content=message, reply_to=eventID)
-                            # await client.send_private_msg(receiver=receiver, message=message, reply_to=None)
-                            # secret = await make_private_msg(keys, event.author(), message)
-                            # await client.send_event(secret)
-                            # await client.send_direct_msg(receiver, message, reply)
-                            encrypted_content = nip04_encrypt(sk, receiver, message)
-                            builder = EventBuilder(Kind(4), encrypted_content).tags([Tag.public_key(receiver)])
-                            await client.send_event_builder(builder)
-                            return "Unsuccessful Decoding"
-                    else:
-                        has_hidden, decoded_text = detect_and_decode_emoji_steganography(str(target_event['content']))
-                        if has_hidden:
-                            logging.info(decoded_text)
-                            encrypted_content = nip04_encrypt(sk, receiver, decoded_text)
-                            builder = EventBuilder(Kind(4), encrypted_content).tags([Tag.public_key(receiver)])
-                            await client.send_event_builder(builder)
-                            return "Successful Decoding!"
-                        else:
+                    with stage("extract_url"):
+                        images = extract_images(str(target_event['content']), target_event.get('tags', []))
+
+                    # Every image decodes in the worker pool at once, the reply waits for all of them
+                    async def reply_with_results(results):
+                        for image, decoded_text in zip(images, results):
+                            logging.info(f"Decoded {image.url}: {decoded_text}")
+                        if not any(result and result is not OVERFLOWED for result in results):
                             logging.info(f"No secret message detected: {target_eventID}")
-                            message = 'No secret message detected'
-                            # await nostrpost(private_key=message, content=message, reply_to=eventID)
-                            # await client.send_private_msg(receiver=receiver, message=message, reply_to=None)
-                            # secret = await make_private_msg(keys, event.author(), message)
-                            # await client.send_event(secret)
-                            # await client.send_direct_msg(receiver, message, reply)
-                            encrypted_content = nip04_encrypt(sk, receiver, message)
-                            builder = EventBuilder(Kind(4), encrypted_content).tags([Tag.public_key(receiver)])
-                            await client.send_event_builder(builder)
-                            return "Unsuccessful Decoding"
+                        await decode_flights.resolve(target_eventID, combine_results(results))
+
+                    group = JobGroup(reply_with_results)
+                    for image in images:
+                        logging.info(f"Extracted image: {image}")
+                        if image.lossy:
+                            # Declared JPEG in its imeta tag, no LSB data survives that
+                            await group.slot()(False)
+                            continue
+                        with stage("cache_lookup"):
+                            found, cached_text = decode_cache.get(image.url)
+                        if found:
+                            logging.info("Decode cache hit")
+                            await group.slot()(cached_text)
+                            continue
+
+                        async def cache_result(decoded_text, image=image):
+                            # None means the download failed, retry next time
+                            if decoded_text is not None:
+                                decode_cache.put(image.url, decoded_text)
+
+                        group.submit(decode_pool, lsb_job, (image.url,), cache_result, image.url)
+                    if not images:
+                        group.submit(decode_pool, emoji_job, (str(target_event['content']),))
+                    await group.close()
+                    return "Decode queued"
                 except Exception as e:
                     logging.error(f"An error occurred: {str(e)}")
                     message = 'Uh-oh! Something broke while trying to decode image'
                     # await nostrpost(private_key=private_key, content=message, reply_to=eventID)
                     # await client.send_private_msg(receiver=receiver, message=message, reply_to=None)
-                    # secret = await make_private_msg(keys, event.author(), message)
-                    # await client.send_event(secret)
-                    # await client.send_direct_msg(receiver, message, reply)
-                    encrypted_content = nip04_encrypt(sk, receiver, message)
-                    builder = EventBuilder(Kind(4), encrypted_content).tags([Tag.public_key(receiver)])
-                    await client.send_event_builder(builder)
+                    if leader:
+                        await decode_flights.resolve(target_eventID, message)
+                    else:
+                        await send_reply(message)
                     return f"Something broke when a New Event path was triggered."
 
         async def handle_msg(self, relay_url, msg):
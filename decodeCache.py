@@ -0,0 +1,114 @@
+import os, sqlite3, time
+from collections import OrderedDict
+
+DECODE_CACHE_PATH = os.environ.get("decode_cache_path", "data/decode_cache.sqlite3")
+DECODE_CACHE_MEMORY_BYTES = int(os.environ.get("decode_cache_memory_bytes", 16 * 1024 * 1024))
+
+MISSING = object()
+
+class LRUCache:
+    """
+    In-memory LRU bounded by the total size of keys and values in bytes.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items = OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    @staticmethod
+    def _cost(key, value):
+        return len(key) + (len(value) if isinstance(value, str) else 0) + 64
+
+    def get(self, key):
+        value = self._items.get(key, MISSING)
+        if value is not MISSING:
+            self._items.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        if key in self._items:
+            self.size -= self._cost(key, self._items.pop(key))
+        cost = self._cost(key, value)
+        if cost > self.max_bytes:
+            return
+        self._items[key] = value
+        self.size += cost
+        while self.size > self.max_bytes:
+            old_key, old_value = self._items.popitem(last=False)
+            self.size -= self._cost(old_key, old_value)
+
+class DecodeCache:
+    """
+    Two tier cache of decode results keyed by image URL.
+
+    Content hashes are not used as keys. Neither one found in a URL nor an
+    imeta hash is checked against the downloaded bytes, so whoever wrote
+    the note could file any image's result under it.
+
+    Hits are served from the memory LRU, then from SQLite, which survives
+    restarts and refills the LRU. Negative results ("no secret message") are
+    stored as False. Transient failures should not be stored at all.
+    """
+    def __init__(self, path=DECODE_CACHE_PATH, memory_bytes=DECODE_CACHE_MEMORY_BYTES):
+        self.memory = LRUCache(memory_bytes)
+        self.hits = 0
+        self.misses = 0
+        self._db = None
+        if path:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._db = sqlite3.connect(path)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS decode_results ("
+                "key TEXT PRIMARY KEY, result TEXT, created_at INTEGER NOT NULL)"
+            )
+            # Rows keyed by unverified content hashes from older versions
+            self._db.execute("DELETE FROM decode_results WHERE key LIKE 'sha256:%'")
+            self._db.commit()
+
+    def get(self, url):
+        """
+        Look up a decode result.
+
+        :return: tuple (bool, result) - (found, decoded text or False)
+        """
+        key = f"url:{url}"
+        value = self.memory.get(key)
+        if value is not MISSING:
+            self.hits += 1
+            return True, value
+        if self._db:
+            row = self._db.execute("SELECT result FROM decode_results WHERE key = ?", (key,)).fetchone()
+            if row:
+                value = row[0] if row[0] is not None else False
+                self.memory.put(key, value)
+                self.hits += 1
+                return True, value
+        self.misses += 1
+        return False, None
+
+    def put(self, url, result):
+        """Store decoded text, or False for images without a message."""
+        value = result if result else False
+        key = f"url:{url}"
+        self.memory.put(key, value)
+        if self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO decode_results (key, result, created_at) VALUES (?, ?, ?)",
+                (key, value or None, int(time.time())),
+            )
+            self._db.commit()
+
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def close(self):
+        if self._db:
+            self._db.close()
+            self._db = None
@@ -0,0 +1,102 @@
+import numpy as np
+
+# Bytes hide in Unicode variation selectors trailing a visible character:
+#   0-15    VS1-VS16    U+FE00-U+FE0F
+#   16-255  VS17-VS256  U+E0100-U+E01EF
+# Renderers drop selectors that do not apply, so the text shows only the
+# base emoji.
+VARIATION_SELECTOR_START = 0xFE00
+VARIATION_SELECTOR_SUPPLEMENT_START = 0xE0100
+DEFAULT_BASE = "\U0001F642"  # 🙂
+
+# Code point of the selector for each byte value
+SELECTOR_TABLE = np.array([VARIATION_SELECTOR_START + byte if byte < 16 else VARIATION_SELECTOR_SUPPLEMENT_START + byte - 16
+                           for byte in range(256)], dtype=np.uint32)
+
+def byte_to_selector(byte):
+    return chr(SELECTOR_TABLE[byte])
+
+def _code_points(text):
+    # One uint32 per character, string offsets index it directly
+    return np.frombuffer(text.encode("utf-32-le", "surrogatepass"), dtype=np.uint32)
+
+def _selector_mask(codes):
+    # Unsigned wrap-around turns both range checks into a single compare
+    return ((codes - np.uint32(VARIATION_SELECTOR_START)) < 16) | \
+        ((codes - np.uint32(VARIATION_SELECTOR_SUPPLEMENT_START)) < 240)
+
+def _selector_bytes(selectors):
+    supplement = selectors >= VARIATION_SELECTOR_SUPPLEMENT_START
+    offset = np.where(supplement, np.uint32(VARIATION_SELECTOR_SUPPLEMENT_START - 16), np.uint32(VARIATION_SELECTOR_START))
+    return (selectors - offset).astype(np.uint8).tobytes()
+
+class Span:
+    """
+    A run of variation selectors and the bytes it holds.
+
+    :param start: Offset of the first selector in the text
+    :param end: Offset just past the last selector
+    :param base: Character the run is attached to, "" at the start of the text
+    :param payload: Decoded bytes
+    """
+    def __init__(self, start, end, base, payload):
+        self.start = start
+        self.end = end
+        self.base = base
+        self.payload = payload
+
+    def text(self):
+        """The payload as UTF-8 text, None if it is not valid UTF-8."""
+        try:
+            return self.payload.decode("utf-8")
+        except UnicodeDecodeError:
+            return None
+
+    def __repr__(self):
+        return f"Span(start={self.start}, end={self.end}, base={self.base!r}, payload={self.payload[:32]!r})"
+
+def encode(data, base=DEFAULT_BASE):
+    """
+    Hide bytes after a base character.
+
+    :param data: bytes, or str which is UTF-8 encoded
+    :param base: Visible character to attach the selectors to
+    :return: str
+    """
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return base + SELECTOR_TABLE[np.frombuffer(bytes(data), dtype=np.uint8)].tobytes().decode("utf-32-le")
+
+def decode(text):
+    """
+    Return the bytes of every variation selector in text, concatenated.
+
+    The text is viewed as an array of code points and the selectors are
+    picked out and mapped with array operations, nothing runs per character
+    in Python.
+    """
+    if text.isascii():
+        return b""
+    codes = _code_points(text)
+    return _selector_bytes(codes[_selector_mask(codes)])
+
+def spans(text, min_length=1):
+    """
+    Find each separate hidden payload in text.
+
+    :param min_length: Ignore runs shorter than this, 2 skips the lone
+        VS16 that turns e.g. U+2764 into a coloured heart
+    :return: list of Span in text order
+    """
+    if text.isascii():
+        return []
+    codes = _code_points(text)
+    mask = _selector_mask(codes).view(np.int8)
+    edges = np.flatnonzero(np.diff(mask, prepend=0, append=0))
+    found = []
+    for start, end in zip(edges[0::2].tolist(), edges[1::2].tolist()):
+        if end - start < min_length:
+            continue
+        base = text[start - 1] if start else ""
+        found.append(Span(start, end, base, _selector_bytes(codes[start:end])))
+    return found
@@ -0,0 +1,80 @@
+import time, logging
+from collections import OrderedDict
+
+SEEN_EVENTS_MAX = 100_000
+SEEN_EVENTS_WINDOW = 6 * 60 * 60
+
+class SeenEvents:
+    """
+    Bounded, time-windowed set of event IDs.
+
+    The same event arrives once per relay it was published to, add() tells
+    the first copy apart from the rest. IDs expire after window seconds and
+    the oldest are evicted beyond max_size.
+    """
+    def __init__(self, max_size=SEEN_EVENTS_MAX, window=SEEN_EVENTS_WINDOW):
+        self.max_size = max_size
+        self.window = window
+        self._seen = OrderedDict()
+
+    def __len__(self):
+        return len(self._seen)
+
+    def __contains__(self, event_id):
+        seen_at = self._seen.get(event_id)
+        return seen_at is not None and time.monotonic() - seen_at < self.window
+
+    def add(self, event_id):
+        """
+        Record an event ID.
+
+        :return: True if the ID is new, False if it was already seen
+        """
+        now = time.monotonic()
+        # Expire from the old end, insertion order is arrival order
+        while self._seen:
+            seen_at = next(iter(self._seen.values()))
+            if now - seen_at < self.window and len(self._seen) < self.max_size:
+                break
+            self._seen.popitem(last=False)
+        if event_id in self._seen:
+            return False
+        self._seen[event_id] = now
+        return True
+
+class SingleFlight:
+    """
+    Coalesces concurrent requests for the same key.
+
+    The first caller to join() a key becomes the leader and does the work,
+    later callers only register a callback. resolve() hands the leader's
+    result to every registered callback and closes the flight.
+    """
+    def __init__(self):
+        self._waiters = {}
+
+    def __len__(self):
+        return len(self._waiters)
+
+    def __contains__(self, key):
+        return key in self._waiters
+
+    def join(self, key, callback):
+        """
+        Register a coroutine function to receive the result for key.
+
+        :return: True if the caller is the leader and must start the work
+        """
+        if key in self._waiters:
+            self._waiters[key].append(callback)
+            return False
+        self._waiters[key] = [callback]
+        return True
+
+    async def resolve(self, key, result):
+        """Deliver result to every caller waiting on key."""
+        for callback in self._waiters.pop(key, []):
+            try:
+                await callback(result)
+            except Exception as e:
+                logging.error(f"Reply for {key} failed: {str(e)}")
@@ -0,0 +1,80 @@
+import struct
+
+from pngStream import PNG_SIGNATURE
+
+# Bytes needed to tell the formats apart, PNG's colour type sits at offset 25
+SNIFF_BYTES = 32
+# Extended WebP may put ICC or EXIF chunks ahead of the image data, past
+# this many bytes stop looking for it and let PIL decide
+SNIFF_MAX_BYTES = 64 * 1024
+
+class UnsupportedFormat(ValueError):
+    """
+    Raised for files that cannot hold an LSB payload, before they are decoded.
+
+    :param format: Short name of the detected format, e.g. "jpeg"
+    :param reason: Why it was rejected
+    """
+    def __init__(self, format, reason):
+        super().__init__(reason)
+        self.format = format
+
+def _png(head):
+    if len(head) < 26 or head[12:16] != b"IHDR":
+        # Too short or malformed, the scanline reader reports it
+        return "png"
+    depth, color_type = head[24], head[25]
+    # Palette entries are 8-bit colours whatever the index depth, only
+    # greyscale under 8 bits has no low bits left to hold data
+    if color_type == 0 and depth < 8:
+        raise UnsupportedFormat("png", f"Greyscale PNG with {depth}-bit samples")
+    return "png"
+
+def _webp(head, complete):
+    # Walk the RIFF chunks to the image data: VP8L is lossless, VP8 (and the
+    # ALPH chunk that only comes with it) lossy
+    position = 12
+    while position + 8 <= len(head):
+        fourcc = head[position:position + 4]
+        if fourcc == b"VP8L":
+            return "webp"
+        if fourcc in (b"VP8 ", b"ALPH"):
+            raise UnsupportedFormat("webp", "Lossy WebP")
+        if fourcc == b"ANMF":
+            # Frame header, then the first frame's own chunks
+            position += 8 + 16
+            continue
+        size = struct.unpack("<I", head[position + 4:position + 8])[0]
+        position += 8 + size + (size & 1)
+    return "webp" if complete or len(head) >= SNIFF_MAX_BYTES else None
+
+def sniff(head, complete=False):
+    """
+    Identify an image file from its first bytes and reject formats whose
+    pixels cannot hold an LSB payload: lossy ones, which requantise every
+    pixel, and greyscale with fewer than 8 bits per sample. Palette images
+    pass, a lossless palette save keeps every colour of a stego image.
+
+    :param head: Leading bytes of the file
+    :param complete: head is the whole file, decide with what is there
+    :return: "png", "webp", "gif", "bmp" or "tiff", None if more bytes are needed
+    :raises: UnsupportedFormat for rejected and unknown files
+    """
+    if len(head) < SNIFF_BYTES and not complete:
+        return None
+    head = bytes(head)
+    if head.startswith(PNG_SIGNATURE):
+        return _png(head)
+    if head.startswith(b"\xff\xd8\xff"):
+        raise UnsupportedFormat("jpeg", "JPEG is lossy")
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return _webp(head, complete)
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    if head[4:8] == b"ftyp":
+        raise UnsupportedFormat("heif", "AVIF and HEIF are lossy")
+    if head[:2] == b"BM":
+        return "bmp"
+    if head[:4] in (b"II*\x00", b"MM\x00*"):
+        return "tiff"
+    raise UnsupportedFormat("unknown", "Not a supported image format")
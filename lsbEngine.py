@@ -0,0 +1,541 @@
+import os, re
+import numpy as np
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+import zlib
+import payloadFormat
+import steganalysis
+from bitPacking import BitReader, BitWriter, pack_symbols
+
+HEADER_BITS = 32  # legacy length header
+FRAME_PREFIX_BITS = payloadFormat.HEADER_BYTES * 8  # enough to size a frame of either version
+DEFAULT_N_BITS = 2
+
+STREAM_CHUNK_SIZE = 64 * 1024  # payload bytes per step in encode_bytes()/decode_bytes()
+
+STRIP_PIXELS = 1 << 20  # pixels per strip in map_strips(), 3 MB of RGB
+STRIP_WORKERS = os.cpu_count() or 1
+
+# Below this many channel values the statistics are noise, and extracting
+# the claimed message costs next to nothing anyway
+PREFILTER_MIN_VALUES = 4096
+
+# Control characters never found in typed text, dark pixel runs read at a
+# high depth look like short ASCII strings made of these
+CONTROL_CHARS = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]")
+RGB = (0, 1, 2)
+
+def image_to_array(image, rows=None):
+    """
+    View a PIL image as a (H, W, 3) uint8 array of RGB channels.
+
+    Modes whose RGB form is a selection of their own bands are not
+    converted: RGBA and RGBX drop alpha/padding and L and LA repeat the grey
+    band, as strided views over the native data. Other modes (P, CMYK, ...)
+    go through convert("RGB").
+
+    :param image: PIL Image object or path to an image
+    :param rows: Only read this many rows from the top (default: all)
+    :return: read-only numpy array of shape (height, width, 3)
+    """
+    if not isinstance(image, Image.Image):
+        image = Image.open(image)
+    if rows is not None and rows < image.height:
+        image = image.crop((0, 0, image.width, rows))
+    if image.mode in ("RGB", "RGBA", "RGBX"):
+        return np.asarray(image)[..., :3]
+    if image.mode in ("L", "LA"):
+        grey = np.asarray(image)
+        if grey.ndim == 3:
+            grey = grey[..., 0]
+        return np.broadcast_to(grey[..., None], grey.shape + (3,))
+    return np.asarray(image.convert("RGB"))
+
+def map_strips(func, images, size, output=None, strip_pixels=STRIP_PIXELS, workers=STRIP_WORKERS):
+    """
+    Apply func to matching row strips of images and assemble the results.
+
+    Strips are cropped out and viewed with image_to_array(), so no image is
+    copied whole, and run on a thread pool since NumPy releases the GIL. At
+    most two strips per worker are in flight, so memory stays flat whatever
+    the image size.
+
+    :param func: Takes one (rows, W, 3) array per image, returns the (rows, W, 3) uint8 result
+    :param images: PIL images, each at least size
+    :param size: (width, height) of the result
+    :param output: RGB PIL image or writable (H, W, 3) uint8 array, e.g. a
+        numpy.memmap, to write into (default: a new RGB image)
+    :return: output
+    """
+    width, height = size
+    for image in images:
+        if image.width < width or image.height < height:
+            raise ValueError(f"Image of {image.size} is smaller than {size}")
+        # Lazy loading from the file is not thread safe, crops are
+        image.load()
+    if output is None:
+        output = Image.new("RGB", size)
+    to_array = isinstance(output, np.ndarray)
+    if to_array and output.shape != (height, width, 3):
+        raise ValueError(f"Output array has shape {output.shape}, expected {(height, width, 3)}")
+    if not to_array and (output.mode != "RGB" or output.size != tuple(size)):
+        raise ValueError(f"Output image must be RGB and {size}")
+    rows = max(1, strip_pixels // width)
+
+    def run(top):
+        bottom = min(top + rows, height)
+        strip = func(*(image_to_array(image.crop((0, top, width, bottom))) for image in images))
+        if to_array:
+            output[top:bottom] = strip
+            return None
+        return top, strip
+
+    def collect(future):
+        result = future.result()
+        if result is not None:
+            top, strip = result
+            output.paste(Image.fromarray(strip, "RGB"), (0, top))
+
+    with ThreadPoolExecutor(workers, thread_name_prefix="steg-strip") as executor:
+        pending = deque()
+        for top in range(0, height, rows):
+            pending.append(executor.submit(run, top))
+            if len(pending) >= 2 * workers:
+                collect(pending.popleft())
+        while pending:
+            collect(pending.popleft())
+    return output
+
+def capacity(pixels, n_bits, channels=RGB):
+    """Number of bits the pixel array can hold at n_bits per channel."""
+    return pixels.shape[0] * pixels.shape[1] * len(channels) * n_bits
+
+def capacity_of(pixels, n_bits, channels=RGB):
+    """capacity() for a pixel array or a PIL image."""
+    width, height = _size(pixels)
+    return width * height * len(channels) * n_bits
+
+def channels_for_bits(bit_count, n_bits):
+    return -(-bit_count // n_bits)
+
+def rows_for_bits(bit_count, n_bits, width, channels=RGB):
+    """Number of rows of a width pixels wide image that hold bit_count bits."""
+    pixels = -(-channels_for_bits(bit_count, n_bits) // len(channels))
+    return -(-pixels // width)
+
+def _check_n_bits(n_bits):
+    if not 1 <= n_bits <= 8:
+        raise ValueError("n_bits must be between 1 and 8")
+
+def _channel_stream(pixels, count, channels):
+    """Flat view of the first pixels that cover count channel values, in channel order."""
+    per_pixel = len(channels)
+    n_pixels = min(-(-count // per_pixel), pixels.shape[0] * pixels.shape[1])
+    rows = -(-n_pixels // pixels.shape[1])
+    prefix = pixels[:rows]
+    if tuple(channels) != RGB:
+        prefix = prefix[..., list(channels)]
+    return prefix.reshape(-1)
+
+def _size(pixels):
+    if isinstance(pixels, Image.Image):
+        return pixels.size
+    return pixels.shape[1], pixels.shape[0]
+
+def _rows(pixels, top, bottom):
+    # Rows [top, bottom) of an array, or of a PIL image as a read-only array
+    if isinstance(pixels, Image.Image):
+        return image_to_array(pixels.crop((0, top, pixels.width, bottom)))
+    return pixels[top:bottom]
+
+def _channel_rows(pixels, first, count, channels):
+    # Rows holding channel values [first, first + count) and the offset of first in them
+    width, height = _size(pixels)
+    per_row = width * len(channels)
+    top = first // per_row
+    bottom = min(-(-(first + count) // per_row), height)
+    return top, bottom, first - top * per_row
+
+def _read_channels(pixels, first, count, channels):
+    """Channel values [first, first + count) of an array or PIL image, reading only their rows."""
+    top, bottom, offset = _channel_rows(pixels, first, count, channels)
+    strip = _rows(pixels, top, bottom)
+    if tuple(channels) != RGB:
+        strip = strip[..., list(channels)]
+    return strip.reshape(-1)[offset:offset + count]
+
+def _write_channels(pixels, first, values, channels):
+    """Overwrite channel values starting at first, in a writable array or an RGB PIL image."""
+    top, bottom, offset = _channel_rows(pixels, first, len(values), channels)
+    strip = np.array(_rows(pixels, top, bottom)) if isinstance(pixels, Image.Image) else pixels[top:bottom]
+    selected = strip if tuple(channels) == RGB else strip[..., list(channels)]
+    flat = selected.reshape(-1)
+    flat[offset:offset + len(values)] = values
+    if not np.shares_memory(flat, strip):
+        strip[..., list(channels)] = flat.reshape(selected.shape)
+    if isinstance(pixels, Image.Image):
+        pixels.paste(Image.fromarray(strip, "RGB"), (0, top))
+
+def read_bytes(pixels, n_bits, start, count, channels=RGB):
+    """
+    Return count bytes of the hidden stream from byte offset start, touching
+    only the channels that hold them.
+
+    :param pixels: (H, W, 3) array or PIL image
+    :raises: ValueError if the image ends first
+    """
+    _check_n_bits(n_bits)
+    first_bit = start * 8
+    first = first_bit // n_bits
+    end = channels_for_bits(first_bit + count * 8, n_bits)
+    symbols = _read_channels(pixels, first, end - first, channels) & np.uint8((1 << n_bits) - 1)
+    if len(symbols) < end - first:
+        raise ValueError("Image ended before the hidden message")
+    reader = BitReader(pack_symbols(symbols, n_bits))
+    reader.skip(first_bit - first * n_bits)
+    return reader.read_bytes(count)
+
+def write_bytes(pixels, n_bits, start, data, channels=RGB):
+    """
+    Embed data into the hidden stream at byte offset start. Bits of channels
+    shared with the bytes around it are kept.
+
+    :param pixels: writable (H, W, 3) array or RGB PIL image, modified in place
+    :raises: ValueError if the image ends first
+    """
+    _check_n_bits(n_bits)
+    width, height = _size(pixels)
+    first_bit = start * 8
+    end_bit = first_bit + len(data) * 8
+    first, end = first_bit // n_bits, channels_for_bits(end_bit, n_bits)
+    if end > width * height * len(channels):
+        raise ValueError(f"Payload is too long to hide. Maximum {capacity_of(pixels, n_bits, channels)} bits can be hidden.")
+
+    mask = (1 << n_bits) - 1
+    writer = BitWriter()
+    lead = first_bit - first * n_bits
+    if lead:
+        writer.write(int(_read_channels(pixels, first, 1, channels)[0] & mask) >> (n_bits - lead), lead)
+    writer.write_bytes(data)
+    tail = end * n_bits - end_bit
+    if tail:
+        writer.write(int(_read_channels(pixels, end - 1, 1, channels)[0]), tail)
+    symbols = BitReader(writer.getvalue(), len(writer)).read_symbols(n_bits)
+
+    keep = np.uint8(0xFF ^ mask)
+    _write_channels(pixels, first, (_read_channels(pixels, first, end - first, channels) & keep) | symbols, channels)
+
+def embed_symbols(pixels, symbols, n_bits, channels=RGB):
+    """
+    Write channel values into the n least significant bits of the first
+    len(symbols) channels, visiting channels in the given order pixel by pixel.
+    Modifies pixels in place.
+    """
+    count = len(symbols)
+    keep = np.uint8(0xFF ^ ((1 << n_bits) - 1))
+    if tuple(channels) == RGB:
+        flat = pixels.reshape(-1)
+        flat[:count] = (flat[:count] & keep) | symbols
+        return pixels
+    stream = _channel_stream(pixels, count, channels)
+    stream[:count] = (stream[:count] & keep) | symbols
+    rows = -(-len(stream) // (pixels.shape[1] * len(channels)))
+    pixels[:rows, :, list(channels)] = stream.reshape(rows, pixels.shape[1], len(channels))
+    return pixels
+
+def extract_symbols(pixels, n_bits, count, start=0, channels=RGB):
+    """Read the n least significant bits of count channels starting at channel start."""
+    stream = _channel_stream(pixels, start + count, channels)
+    return stream[start:start + count] & np.uint8((1 << n_bits) - 1)
+
+def encode_payload(pixels, payload, n_bits, channels=RGB, compression="auto", version=payloadFormat.VERSION):
+    """
+    Hide payload bytes in a v2 frame (or a legacy 32-bit bit-length header).
+
+    :param pixels: writable (H, W, 3) uint8 array
+    :param payload: bytes to hide
+    :param n_bits: Number of least significant bits to use (1-8)
+    :param compression: "auto", "none", "zlib" or "lzma", v2 only
+    :param version: 2 for a framed payload, 1 for the legacy format
+    :return: the modified pixel array
+    """
+    symbols = _frame_symbols(payload, n_bits, capacity(pixels, n_bits, channels), compression, version)
+    return embed_symbols(pixels, symbols, n_bits, channels)
+
+def encode_image(image, payload, n_bits, channels=RGB, compression="auto", version=payloadFormat.VERSION):
+    """
+    encode_payload() into an RGB PIL image in place.
+
+    Only the rows the frame covers are copied out, embedded into and pasted
+    back, the rest of the image is never copied.
+
+    :param image: PIL Image in RGB mode
+    :return: the modified image
+    """
+    if image.mode != "RGB":
+        raise ValueError(f"Cannot embed into a {image.mode} image, convert it to RGB first")
+    width, height = image.size
+    symbols = _frame_symbols(payload, n_bits, width * height * len(channels) * n_bits, compression, version)
+    rows = min(rows_for_bits(len(symbols) * n_bits, n_bits, width, channels), height)
+    strip = np.array(image.crop((0, 0, width, rows)))
+    embed_symbols(strip, symbols, n_bits, channels)
+    image.paste(Image.fromarray(strip, "RGB"), (0, 0))
+    return image
+
+def _frame_symbols(payload, n_bits, max_bits, compression, version):
+    _check_n_bits(n_bits)
+    if version == payloadFormat.VERSION:
+        frame = payloadFormat.pack(payload, n_bits, compression)
+    else:
+        frame = payloadFormat.pack_legacy(payload)
+    writer = BitWriter()
+    writer.write_bytes(frame)
+
+    if len(writer) > max_bits:
+        raise ValueError(f"Text is too long to hide. Maximum {max_bits} bits can be hidden.")
+    return BitReader(writer.getvalue(), len(writer)).read_symbols(n_bits)
+
+def read_length_header(pixels, n_bits, channels=RGB):
+    """Return the payload length in bits claimed by the legacy 32-bit header."""
+    _check_n_bits(n_bits)
+    count = channels_for_bits(HEADER_BITS, n_bits)
+    symbols = extract_symbols(pixels, n_bits, count, channels=channels)
+    if len(symbols) < count:
+        raise ValueError("Image is too small to hold a length header")
+    return BitReader(pack_symbols(symbols, n_bits)).read(HEADER_BITS)
+
+def read_prefix(pixels, n_bits, byte_count, channels=RGB):
+    """Return the first byte_count bytes of the hidden stream, fewer if the image is smaller."""
+    _check_n_bits(n_bits)
+    byte_count = min(byte_count, capacity(pixels, n_bits, channels) // 8)
+    symbols = extract_symbols(pixels, n_bits, channels_for_bits(byte_count * 8, n_bits), channels=channels)
+    return pack_symbols(symbols, n_bits)[:byte_count]
+
+def read_frame_header(pixels, n_bits, channels=RGB):
+    """
+    Parse the frame header of either version from the first pixels.
+
+    :return: payloadFormat.FrameHeader
+    :raises: ValueError if the pixels do not start with a frame that fits
+    """
+    prefix = read_prefix(pixels, n_bits, payloadFormat.HEADER_BYTES, channels)
+    return payloadFormat.parse_header(prefix, n_bits, capacity(pixels, n_bits, channels) // 8)
+
+def frame_candidates(pixels, channels=RGB, pixel_count=None, prefer=DEFAULT_N_BITS):
+    """
+    Find every n_bits value whose header region holds a plausible frame.
+
+    The channels covering the header at n_bits=1 (the most any depth needs)
+    are read once, and all eight depths are evaluated on that same prefix.
+    v2 frames come first, then legacy headers with prefer ahead of the rest.
+    Empty legacy messages are skipped, blank images claim those at every depth.
+
+    :param pixels: (H, W, 3) array, only the first rows are needed
+    :param pixel_count: Pixels in the whole image if pixels is only its first rows
+    :return: list of (n_bits, payloadFormat.FrameHeader), best first
+    """
+    if pixel_count is None:
+        pixel_count = pixels.shape[0] * pixels.shape[1]
+    values = _channel_stream(pixels, FRAME_PREFIX_BITS, channels)[:FRAME_PREFIX_BITS]
+    framed, legacy = [], []
+    for n_bits in range(1, 9):
+        count = min(channels_for_bits(FRAME_PREFIX_BITS, n_bits), len(values))
+        prefix = pack_symbols(values[:count] & np.uint8((1 << n_bits) - 1), n_bits)[:count * n_bits // 8]
+        max_bytes = pixel_count * len(channels) * n_bits // 8
+        try:
+            header = payloadFormat.parse_header(prefix, n_bits, max_bytes)
+        except payloadFormat.FrameError:
+            continue
+        if header.version == payloadFormat.VERSION:
+            framed.append((n_bits, header))
+        elif header.length:
+            legacy.append((n_bits, header))
+    legacy.sort(key=lambda candidate: candidate[0] != prefer)
+    return framed + legacy
+
+def prefilter_span(n_bits, header, channels=RGB):
+    """
+    Channel values to test before trusting a frame header: the start of the
+    region a legacy header claims. 0 when there is nothing worth testing,
+    v2 frames are checked by their magic and CRC instead.
+    """
+    if header.version == payloadFormat.VERSION:
+        return 0
+    count = channels_for_bits(header.total_bytes * 8, n_bits)
+    if count < PREFILTER_MIN_VALUES:
+        return 0
+    return min(count, steganalysis.MAX_SAMPLE)
+
+def looks_embedded(pixels, n_bits, header, threshold=steganalysis.PREFILTER_THRESHOLD, channels=RGB):
+    """
+    Steganalysis pre-filter for the region a frame header claims.
+
+    :param pixels: (H, W, 3) array, the first rows of the image are enough
+    :return: True if the claimed message is worth extracting
+    """
+    count = prefilter_span(n_bits, header, channels)
+    if not count:
+        return True
+    rows = rows_for_bits(count, 1, pixels.shape[1], channels)
+    return steganalysis.stego_confidence(pixels[:rows], n_bits=n_bits).confidence >= threshold
+
+def decode_frame(pixels, n_bits, header, channels=RGB, require_text=False):
+    """
+    Return the payload of a frame whose header was already parsed.
+
+    :param require_text: Reject legacy payloads that are not UTF-8 text, used
+        when the depth was guessed (the legacy format only ever held text)
+    :raises: ValueError if the payload does not check out
+    """
+    payload = payloadFormat.unpack(read_prefix(pixels, n_bits, header.total_bytes, channels), header)
+    if require_text and header.version != payloadFormat.VERSION:
+        try:
+            text = payload.decode()
+        except UnicodeDecodeError:
+            text = None
+        if text is None or CONTROL_CHARS.search(text):
+            raise payloadFormat.FrameError(f"Legacy payload at n_bits={n_bits} is not text")
+    return payload
+
+def decode_payload(pixels, n_bits=None, channels=RGB, prefilter=None):
+    """
+    Read the frame header and return the payload bytes it describes.
+
+    Reads v2 frames and legacy length-prefixed payloads. Without n_bits the
+    depth is detected from the header region, see frame_candidates().
+
+    :param prefilter: Confidence threshold for looks_embedded(), legacy
+        frames scoring below it are not extracted (default: no pre-filter)
+    :raises: ValueError if the header does not describe a payload that fits
+    """
+    height, width = pixels.shape[:2]
+    return _decode_rows(lambda rows: pixels[:rows], width, height, n_bits, channels, prefilter)
+
+def decode_image(image, n_bits=None, channels=RGB, prefilter=None):
+    """
+    decode_payload() for a PIL image or image path.
+
+    Only the rows the header and the frame occupy are turned into an array,
+    see image_to_array().
+    """
+    if not isinstance(image, Image.Image):
+        image = Image.open(image)
+    width, height = image.size
+    return _decode_rows(lambda rows: image_to_array(image, rows), width, height, n_bits, channels, prefilter)
+
+def _decode_rows(read_rows, width, height, n_bits, channels, prefilter):
+    # read_rows(count) returns the first count rows as an (count, W, 3) array
+    pixel_count = width * height
+    head = read_rows(min(rows_for_bits(FRAME_PREFIX_BITS, n_bits or 1, width, channels), height))
+    if n_bits is not None:
+        _check_n_bits(n_bits)
+        prefix = read_prefix(head, n_bits, payloadFormat.HEADER_BYTES, channels)
+        max_bytes = pixel_count * len(channels) * n_bits // 8
+        candidates = [(n_bits, payloadFormat.parse_header(prefix, n_bits, max_bytes))]
+    else:
+        candidates = frame_candidates(head, channels, pixel_count)
+
+    error = ValueError("No plausible message header at any n_bits")
+    for depth, header in candidates:
+        span = prefilter_span(depth, header, channels) if prefilter is not None else 0
+        if span:
+            check = read_rows(min(rows_for_bits(span * depth, depth, width, channels), height))
+            if not looks_embedded(check, depth, header, prefilter, channels):
+                error = ValueError("LSB statistics suggest no hidden data")
+                continue
+        pixels = read_rows(min(rows_for_bits(header.total_bytes * 8, depth, width, channels), height))
+        try:
+            return decode_frame(pixels, depth, header, channels, require_text=n_bits is None)
+        except ValueError as e:
+            error = e
+    raise error
+
+def encode_bytes(pixels, source, n_bits, channels=RGB, compression="none", chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Embed a payload read in chunks as a v2 frame.
+
+    The stored bytes are written as they arrive and the header last, once
+    their length and checksum are known, so memory use follows chunk_size
+    and not the payload size. If the payload turns out not to fit, the
+    image is left partially written.
+
+    :param pixels: writable (H, W, 3) array or RGB PIL image, modified in place
+    :param source: binary file-like object or iterable of bytes chunks
+    :param compression: "none", "zlib" or "lzma"
+    :return: number of payload bytes read from source
+    """
+    _check_n_bits(n_bits)
+    compressor = payloadFormat.compressor(compression)
+    if hasattr(source, "read"):
+        source = iter(lambda read=source.read: read(chunk_size), b"")
+    position = payloadFormat.HEADER_BYTES
+    crc = 0
+    consumed = 0
+
+    def store(data):
+        nonlocal position, crc
+        if data:
+            write_bytes(pixels, n_bits, position, data, channels)
+            position += len(data)
+            crc = zlib.crc32(data, crc)
+
+    for chunk in source:
+        consumed += len(chunk)
+        store(compressor.compress(chunk) if compressor else chunk)
+    if compressor:
+        store(compressor.flush())
+    header = payloadFormat.pack_header(n_bits, compression, position - payloadFormat.HEADER_BYTES, crc)
+    write_bytes(pixels, n_bits, 0, header, channels)
+    return consumed
+
+def decode_bytes(pixels, sink=None, n_bits=None, channels=RGB, chunk_size=STREAM_CHUNK_SIZE,
+                 max_bytes=payloadFormat.MAX_UNPACKED_BYTES):
+    """
+    Extract a payload in chunks.
+
+    The checksum is verified in a first pass over the stored bytes, before
+    anything is returned, and the payload is then read and decompressed
+    chunk by chunk. Without n_bits only v2 frames are detected, legacy
+    frames hold text and are better read with decode_payload().
+
+    :param pixels: (H, W, 3) array or PIL image
+    :param sink: Binary file-like object to write the payload to
+    :return: number of bytes written to sink, or a generator of payload
+        chunks if there is no sink
+    :raises: ValueError if there is no valid frame
+    """
+    width, height = _size(pixels)
+    if n_bits is None:
+        head = _rows(pixels, 0, rows_for_bits(FRAME_PREFIX_BITS, 1, width, channels))
+        framed = [candidate for candidate in frame_candidates(head, channels, width * height)
+                  if candidate[1].version == payloadFormat.VERSION]
+        if not framed:
+            raise ValueError("No framed message at any n_bits")
+        n_bits, header = framed[0]
+    else:
+        # Bounds the stored frame, max_bytes stays the cap on the unpacked payload
+        capacity = capacity_of(pixels, n_bits, channels) // 8
+        prefix = read_bytes(pixels, n_bits, 0, min(payloadFormat.HEADER_BYTES, capacity), channels)
+        header = payloadFormat.parse_header(prefix, n_bits, capacity)
+
+    def stored():
+        for start in range(0, header.length, chunk_size):
+            yield read_bytes(pixels, n_bits, header.header_bytes + start,
+                             min(chunk_size, header.length - start), channels)
+
+    if header.version == payloadFormat.VERSION:
+        crc = 0
+        for data in stored():
+            crc = zlib.crc32(data, crc)
+        if crc != header.crc:
+            raise payloadFormat.FrameError("Payload checksum mismatch")
+    chunks = payloadFormat.iter_decompress(stored(), header.compression, max_bytes, chunk_size)
+    if sink is None:
+        return chunks
+    written = 0
+    for data in chunks:
+        sink.write(data)
+        written += len(data)
+    return written
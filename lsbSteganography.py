@@ -1,12 +1,41 @@
 # watch the video for this project here: https://youtu.be/bZ88gnHzwz8
-import requests, statistics
+import requests, itertools, time
+import numpy as np
 from PIL import Image
-from io import BytesIO
 import re
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import HTTPError as Urllib3Error
+
+import lsbEngine
+import payloadFormat
+from steganalysis import PREFILTER_THRESHOLD
+from imageFormat import SNIFF_BYTES
+from metrics import stage, observe_stage
+from progressiveDecode import ProgressiveDecoder, decode_stream
 
 MAX_COLOR_VALUE = 256
 MAX_BIT_VALUE = 8
 
+# Image links end in an extension, in any case, optionally followed by a
+# query string. CDN proxies that carry the original URL in the query
+# (e.g. media-cache?u=...%2Fx.jpg) match up to that inner extension. The
+# query string never ends in sentence punctuation, "see x.png?w=100." stops
+# before the full stop, and only keeps a ")" that closes a "(" inside it, so
+# "(x.png?y=(2))" keeps one.
+IMAGE_URL = re.compile(r'https?://[^\s<>"\']+?\.(?:png|jpe?g|webp)(?![\w/-]|\.\w)'
+                       r'(?:[?#&](?:\([^\s<>"\'()]*\)|[^\s<>"\')\]])*(?<![.,!?;:]))?',
+                       re.IGNORECASE)
+# JPEG re-quantises every pixel, LSB data cannot survive it. WebP may be lossless.
+LOSSY_MIME_TYPES = ("image/jpeg", "image/jpg", "image/pjpeg")
+
+MAX_DOWNLOAD_BYTES = 32 * 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# Keep-alive HTTP session of each decode worker process
+SESSION_HOSTS = 16  # hosts whose connections are kept open
+FETCH_TIMEOUT = 30  # overall download limit for a decode job
+_session = None
+
 def make_image(data, resolution):
     image = Image.new("RGB", resolution)
     image.putdata(data)
@@ -28,61 +57,34 @@ def get_n_most_significant_bits(value, n):
 def shit_n_bits_to_8(value, n):
     return value << MAX_BIT_VALUE - n
 
-def lsbencode(image_to_hide, image_to_hide_in, n_bits):
-
-    width, height = image_to_hide.size
-
-    hide_image = image_to_hide.load()
-    hide_in_image = image_to_hide_in.load()
-
-    data = []
-
-    for y in range(height):
-        for x in range(width):
-
-            # (107, 3, 10)
-            # most sig bits
-            r_hide, g_hide, b_hide = hide_image[x,y]
-
-            r_hide = get_n_most_significant_bits(r_hide, n_bits)
-            g_hide = get_n_most_significant_bits(g_hide, n_bits)
-            b_hide = get_n_most_significant_bits(b_hide, n_bits)
-
-            # remove lest n sig bits
-            r_hide_in, g_hide_in, b_hide_in = hide_in_image[x,y]
-
-            r_hide_in = remove_n_least_significant_bits(r_hide_in, n_bits)
-            g_hide_in = remove_n_least_significant_bits(g_hide_in, n_bits)
-            b_hide_in = remove_n_least_significant_bits(b_hide_in, n_bits)
-
-            data.append((r_hide + r_hide_in, 
-                         g_hide + g_hide_in,
-                         b_hide + b_hide_in))
-
-    return make_image(data, image_to_hide.size)
+def lsbencode(image_to_hide, image_to_hide_in, n_bits, output=None):
+    """
+    Hide the n most significant bits of image_to_hide in the n least
+    significant bits of image_to_hide_in.
 
-def lsbdecode(image_to_decode, n_bits):
-    width, height = image_to_decode.size
-    encoded_image = image_to_decode.load()
+    :param output: Image or writable array to write into, see lsbEngine.map_strips()
+    :return: Encoded image, output if one was given
+    """
+    keep = np.uint8(0xFF ^ ((1 << n_bits) - 1))
 
-    data = []
+    def encode_strip(hide, hide_in):
+        return (hide >> (MAX_BIT_VALUE - n_bits)) | (hide_in & keep)
 
-    for y in range(height):
-        for x in range(width):
+    return lsbEngine.map_strips(encode_strip, [image_to_hide, image_to_hide_in], image_to_hide.size, output)
 
-            r_encoded, g_encoded, b_encoded = encoded_image[x,y]
-            
-            r_encoded = get_n_least_significant_bits(r_encoded, n_bits)
-            g_encoded = get_n_least_significant_bits(g_encoded, n_bits)
-            b_encoded = get_n_least_significant_bits(b_encoded, n_bits)
+def lsbdecode(image_to_decode, n_bits, output=None):
+    """
+    Recover the image hidden by lsbencode() from the n least significant bits.
 
-            r_encoded = shit_n_bits_to_8(r_encoded, n_bits)
-            g_encoded = shit_n_bits_to_8(g_encoded, n_bits)
-            b_encoded = shit_n_bits_to_8(b_encoded, n_bits)
+    :param output: Image or writable array to write into, see lsbEngine.map_strips()
+    :return: Decoded image, output if one was given
+    """
+    mask = np.uint8((1 << n_bits) - 1)
 
-            data.append((r_encoded, g_encoded, b_encoded))
+    def decode_strip(encoded):
+        return (encoded & mask) << np.uint8(MAX_BIT_VALUE - n_bits)
 
-    return make_image(data, image_to_decode.size)
+    return lsbEngine.map_strips(decode_strip, [image_to_decode], image_to_decode.size, output)
 
 def resize_and_pad(image_to_hide, target_size):
     """
@@ -103,131 +105,88 @@ def resize_and_pad(image_to_hide, target_size):
 
 def text_to_binary(text):
     """Convert text to binary representation."""
-    binary = bin(int.from_bytes(text.encode(), 'big'))[2:]
-    # Pad the binary string to ensure it's a multiple of 8
-    return binary.zfill((len(binary) + 7) // 8 * 8)
+    bits = np.unpackbits(np.frombuffer(text.encode(), dtype=np.uint8))
+    return (bits + ord("0")).tobytes().decode()
 
 def binary_to_text(binary):
     """Convert binary representation back to text."""
     # Convert binary string to bytes
-    n = int(binary, 2)
-    return n.to_bytes((n.bit_length() + 7) // 8, 'big').decode()
+    bits = np.frombuffer(binary.encode(), dtype=np.uint8) - ord("0")
+    return np.packbits(bits).tobytes().decode()
 
-def encode_text_in_image(image_path, text, n_bits=2):
+def encode_text_in_image(image_path, text, n_bits=2, compression="auto"):
     """
     Encode text into an image using LSB steganography.
     
     :param image_path: Path to the carrier image
     :param text: Text to hide
     :param n_bits: Number of least significant bits to use (default 2)
+    :param compression: "auto", "none", "zlib" or "lzma"
     :return: Modified image with encoded text
     """
-    # Open the image
-    image = Image.open(image_path).convert("RGB")
-    pixels = image.load()
-    width, height = image.size
+    # RGB images are embedded into as loaded, other modes need an RGB copy for the output anyway
+    with stage("image_open"):
+        image = Image.open(image_path)
+        image = image.convert("RGB") if image.mode != "RGB" else image
 
-    # Convert text to binary
-    binary_text = text_to_binary(text)
-    
-    # Add length of text as prefix (to know how much to decode later)
-    binary_text = f"{len(binary_text):032b}" + binary_text
-    
-    # Check if image is large enough to hide the text
-    max_text_bits = (width * height * 3 * n_bits)
-    if len(binary_text) > max_text_bits:
-        raise ValueError(f"Text is too long to hide. Maximum {max_text_bits} bits can be hidden.")
-
-    # Encode binary text into image
-    binary_index = 0
-    for y in range(height):
-        for x in range(width):
-            # Get current pixel
-            r, g, b = pixels[x, y]
-            
-            # Modify color channels
-            if binary_index < len(binary_text):
-                # Red channel
-                r_modified = (r & ~((1 << n_bits) - 1)) | int(binary_text[binary_index:binary_index+n_bits], 2)
-                binary_index += n_bits
-            
-            if binary_index < len(binary_text):
-                # Green channel
-                g_modified = (g & ~((1 << n_bits) - 1)) | int(binary_text[binary_index:binary_index+n_bits], 2)
-                binary_index += n_bits
-            
-            if binary_index < len(binary_text):
-                # Blue channel
-                b_modified = (b & ~((1 << n_bits) - 1)) | int(binary_text[binary_index:binary_index+n_bits], 2)
-                binary_index += n_bits
-            
-            # Update pixel
-            pixels[x, y] = (r_modified, g_modified, b_modified)
-            
-            # Stop if we've encoded entire text
-            if binary_index >= len(binary_text):
-                break
-        
-        if binary_index >= len(binary_text):
-            break
+    # The v2 frame header is added by the engine
+    with stage("lsb_embed"):
+        lsbEngine.encode_image(image, text.encode(), n_bits, compression=compression)
 
     return image
 
-def decode_text_from_image(image_path, n_bits=2):
+def decode_text_from_image(image_path, n_bits=None, progressive=False):
     """
     Decode hidden text from an image.
     
     :param image_path: Path to the image with hidden text
-    :param n_bits: Number of least significant bits used (default 2)
+    :param n_bits: Number of least significant bits used (default: detect)
+    :param progressive: Stop reading the file once the message is decoded
     :return: Decoded text
     """
-    # Open the image
-    image = Image.open(image_path).convert("RGB")
-    pixels = image.load()
-    width, height = image.size
-
-    # Decode binary text
-    binary_text = ""
-    bit_count = 0
-    text_length = None
-
-    for y in range(height):
-        for x in range(width):
-            r, g, b = pixels[x, y]
-            
-            # Extract bits from each channel
-            r_bits = r & ((1 << n_bits) - 1)
-            binary_text += format(r_bits, f'0{n_bits}b')
-            bit_count += n_bits
-            
-            if text_length is None and bit_count >= 32:
-                # First 32 bits represent the total text length
-                text_length = int(binary_text[:32], 2)
-                binary_text = binary_text[32:]
-                bit_count -= 32
-            
-            if text_length is not None and bit_count >= text_length:
-                break
-            
-            g_bits = g & ((1 << n_bits) - 1)
-            binary_text += format(g_bits, f'0{n_bits}b')
-            bit_count += n_bits
-            
-            if text_length is not None and bit_count >= text_length:
-                break
-            
-            b_bits = b & ((1 << n_bits) - 1)
-            binary_text += format(b_bits, f'0{n_bits}b')
-            bit_count += n_bits
-            
-            if text_length is not None and bit_count >= text_length:
-                break
-        
-        if text_length is not None and bit_count >= text_length:
-            break
+    if progressive:
+        with open(image_path, "rb") as stream:
+            return decode_stream(stream, n_bits).decode()
 
-    # Trim to exact text length and convert back to text
-    return binary_to_text(binary_text[:text_length])
+    with stage("image_open"):
+        image = Image.open(image_path)
+        image.load()
+    with stage("lsb_extract"):
+        return lsbEngine.decode_image(image, n_bits).decode()
+
+def encode_bytes_in_image(image_path, source, n_bits=2, compression="none"):
+    """
+    Encode a binary payload into an image, reading it in chunks.
+    
+    :param image_path: Path to the carrier image
+    :param source: Binary file-like object or iterable of bytes chunks
+    :param n_bits: Number of least significant bits to use (default 2)
+    :param compression: "none", "zlib" or "lzma"
+    :return: Modified image with the encoded payload
+    """
+    with stage("image_open"):
+        image = Image.open(image_path)
+        image = image.convert("RGB") if image.mode != "RGB" else image
+
+    with stage("lsb_embed"):
+        lsbEngine.encode_bytes(image, source, n_bits, compression=compression)
+
+    return image
+
+def decode_bytes_from_image(image_path, sink=None, n_bits=None):
+    """
+    Decode a binary payload from an image in chunks.
+    
+    :param image_path: Path to the image with the hidden payload
+    :param sink: Binary file-like object to write the payload to
+    :param n_bits: Number of least significant bits used (default: detect)
+    :return: Bytes written to sink, or an iterator of payload chunks without a sink
+    """
+    with stage("image_open"):
+        image = Image.open(image_path)
+        image.load()
+    with stage("lsb_extract"):
+        return lsbEngine.decode_bytes(image, sink, n_bits)
 
 # def decode_text_from_url(image_url, n_bits=2):
 #     """
@@ -296,134 +255,131 @@ def decode_text_from_image(image_path, n_bits=2):
 #     except Exception as e:
 #         raise ValueError(f"Failed to process image: {str(e)}")
     
-def validate_steganography(image, n_bits=2):
+def validate_steganography(image, n_bits=2, threshold=PREFILTER_THRESHOLD):
     """
     Validate if an image likely contains steganographic content.
     
     :param image: PIL Image object
     :param n_bits: Number of least significant bits used
+    :param threshold: Steganalysis confidence a legacy message region must reach
     :return: tuple (bool, str) - (is_valid, reason)
     """
-    pixels = image.load()
-    width, height = image.size
-    
-    # Check 1: Get the first 32 bits to read the claimed length
-    binary_text = ""
-    for y in range(min(4, height)):  # We only need first few pixels for length
-        for x in range(min(4, width)):
-            r, g, b = pixels[x, y]
-            r_bits = r & ((1 << n_bits) - 1)
-            binary_text += format(r_bits, f'0{n_bits}b')
-            if len(binary_text) >= 32:
-                break
-        if len(binary_text) >= 32:
-            break
+    pixels = lsbEngine.image_to_array(image)
     
+    # Check 1: Read the frame header the decoders use
     try:
-        claimed_length = int(binary_text[:32], 2)
-        
-        # Check if claimed length is reasonable
-        max_possible_length = (width * height * 3 * n_bits) // 8
-        if claimed_length <= 0 or claimed_length > max_possible_length:
-            return False, "Invalid claimed message length"
-            
-        # Check if claimed length is suspiciously large
-        if claimed_length > max_possible_length // 2:
-            return False, "Suspiciously large message length"
+        header = lsbEngine.read_frame_header(pixels, n_bits)
     except ValueError:
-        return False, "Invalid length encoding"
-    
-    # Check 2: Statistical analysis of least significant bits
-    # Sample a portion of the image to save processing time
-    sample_size = min(1000, width * height)
-    lsb_values = []
-    
-    for i in range(sample_size):
-        x = i % width
-        y = i // width
-        r, g, b = pixels[x, y]
-        lsb_values.extend([
-            r & ((1 << n_bits) - 1),
-            g & ((1 << n_bits) - 1),
-            b & ((1 << n_bits) - 1)
-        ])
-    
-    # Calculate statistics of LSBs
-    std_dev = statistics.stdev(lsb_values)
-    mean = statistics.mean(lsb_values)
+        return False, "Invalid claimed message length"
+
+    # Magic, version, n_bits and flags all matched
+    if header.version == payloadFormat.VERSION:
+        return True, "Image contains a framed message"
+
+    # Legacy header, check if claimed length is reasonable
+    claimed_length = header.length * 8
+    max_possible_length = lsbEngine.capacity(pixels, n_bits) - lsbEngine.HEADER_BITS
+    if claimed_length <= 0:
+        return False, "Invalid claimed message length"
+
+    # Check if claimed length is suspiciously large
+    if claimed_length > max_possible_length // 2:
+        return False, "Suspiciously large message length"
     
-    # In true steganographic images, LSBs should be fairly random
-    # If they're too uniform or too patterned, it's probably not steganographic
-    if std_dev < 0.5 or (mean < 0.1 or mean > (2**n_bits - 0.1)):
+    # Check 2: Chi-square and RS steganalysis of the region the message claims
+    if not lsbEngine.looks_embedded(pixels, n_bits, header, threshold):
         return False, "LSB pattern suggests no hidden data"
     
     return True, "Image likely contains hidden data"
 
-def decode_text_from_url(image_url, n_bits=2):
+def get_session():
+    """Return the process wide keep-alive session, creating it on first use."""
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=SESSION_HOSTS)
+        _session.mount("http://", adapter)
+        _session.mount("https://", adapter)
+    return _session
+
+def _read_available(response, size):
     """
-    Decode hidden text from an image accessed via URL.
+    Body chunks of up to size bytes as they arrive. Unlike iter_content, a
+    read does not wait for the whole chunk, so a slow sender cannot hold it
+    past the caller's deadline.
+    """
+    try:
+        while True:
+            chunk = response.raw.read1(size, decode_content=True)
+            if not chunk:
+                return
+            yield chunk
+    except Urllib3Error as e:
+        raise requests.ConnectionError(e)
+
+def decode_payload_from_url(image_url, n_bits=None, max_bytes=MAX_DOWNLOAD_BYTES, timeout=10, session=None, prefilter=None, deadline=None):
+    """
+    Stream an image from a URL into the progressive decoder.
+
+    The connection is closed as soon as the message is decoded or the image
+    is rejected, so only the leading part of the file is usually downloaded.
     
     :param image_url: URL of the image with hidden text
-    :param n_bits: Number of least significant bits used (default 2)
-    :return: Decoded text or error message
+    :param n_bits: Number of least significant bits used (default: detect)
+    :param max_bytes: Hard cap on downloaded bytes. The declared size is not
+        checked up front since a large PNG usually stops well before its end.
+    :param timeout: Connect and read timeout in seconds
+    :param deadline: Overall time limit in seconds, checked at every read so
+        a slow trickle is cut off too. A stalled read can overrun it by at
+        most timeout. (default: none)
+    :param session: requests.Session to reuse connections from (default: no pooling)
+    :param prefilter: Steganalysis confidence threshold, legacy messages in
+        regions scoring below it are not extracted (default: off)
+    :return: Decoded payload bytes
+    :raises: RequestException if URL fetch fails or passes the deadline, ValueError if the image is rejected
     """
-    try:
-        # Download the image from URL
-        response = requests.get(image_url, timeout=10)
+    expires = time.monotonic() + deadline if deadline else None
+    decoder = ProgressiveDecoder(n_bits, prefilter=prefilter)
+    with stage("http_connect"):
+        response = (session or requests).get(image_url, timeout=timeout, stream=True)
+    with response:
         response.raise_for_status()
-        
-        # Create image from downloaded bytes
-        image = Image.open(BytesIO(response.content)).convert("RGB")
-        
-        # # Validate if image contains steganographic content
-        # is_valid, reason = validate_steganography(image, n_bits)
-        # if not is_valid:
-        #     # return f"No hidden message detected: {reason}"
-        #     return False
-        
-        pixels = image.load()
-        width, height = image.size
-
-        # Decode binary text
-        binary_text = ""
-        bit_count = 0
-        text_length = None
 
-        for y in range(height):
-            for x in range(width):
-                r, g, b = pixels[x, y]
-                
-                # Extract bits from each channel
-                r_bits = r & ((1 << n_bits) - 1)
-                binary_text += format(r_bits, f'0{n_bits}b')
-                bit_count += n_bits
-                
-                if text_length is None and bit_count >= 32:
-                    text_length = int(binary_text[:32], 2)
-                    binary_text = binary_text[32:]
-                    bit_count -= 32
-                
-                if text_length is not None and bit_count >= text_length:
-                    break
-                
-                g_bits = g & ((1 << n_bits) - 1)
-                binary_text += format(g_bits, f'0{n_bits}b')
-                bit_count += n_bits
-                
-                if text_length is not None and bit_count >= text_length:
-                    break
-                
-                b_bits = b & ((1 << n_bits) - 1)
-                binary_text += format(b_bits, f'0{n_bits}b')
-                bit_count += n_bits
-                
-                if text_length is not None and bit_count >= text_length:
-                    break
-            
-            if text_length is not None and bit_count >= text_length:
+        # Download and decode interleave, split the time between the two stages
+        received = 0
+        decoding = 0.0
+        started = time.perf_counter()
+        # The first read is just enough to sniff the format, a rejected file is closed right after it
+        chunks = itertools.chain(itertools.islice(response.iter_content(SNIFF_BYTES), 1),
+                                 _read_available(response, DOWNLOAD_CHUNK_SIZE))
+        for chunk in chunks:
+            if expires and time.monotonic() > expires:
+                raise requests.Timeout(f"Download took longer than {deadline} s")
+            received += len(chunk)
+            if received > max_bytes:
+                raise ValueError(f"Image exceeds the {max_bytes} byte limit")
+            fed = time.perf_counter()
+            done = decoder.feed(chunk)
+            decoding += time.perf_counter() - fed
+            if done:
                 break
+        observe_stage("http_download", time.perf_counter() - started - decoding)
 
-        return binary_to_text(binary_text[:text_length])
+    finished = time.perf_counter()
+    payload = decoder.finish()
+    observe_stage("image_decode", decoding + time.perf_counter() - finished)
+    return payload
+
+def decode_text_from_url(image_url, n_bits=None):
+    """
+    Decode hidden text from an image accessed via URL.
+    
+    :param image_url: URL of the image with hidden text
+    :param n_bits: Number of least significant bits used (default: detect)
+    :return: Decoded text or error message
+    """
+    try:
+        return decode_payload_from_url(image_url, n_bits, prefilter=PREFILTER_THRESHOLD).decode()
 
     except requests.RequestException as e:
         # return f"Failed to download image from URL: {str(e)}"
@@ -432,11 +388,82 @@ def decode_text_from_url(image_url, n_bits=2):
         # return f"Failed to process image: {str(e)}"
         return False
 
+class ImageRef:
+    """
+    An image linked from a note.
+
+    :param url: Image URL
+    :param mime: MIME type declared in the note's imeta tag, None if unknown
+    :param sha256: Hex SHA-256 of the file as declared in the imeta tag, unverified,
+        never use it to share results between notes
+    :param dim: "WxH" from the imeta tag
+    """
+    def __init__(self, url, mime=None, sha256=None, dim=None):
+        self.url = url
+        self.mime = mime
+        self.sha256 = sha256
+        self.dim = dim
+
+    @property
+    def lossy(self):
+        """True if the declared type cannot carry LSB data, so there is nothing to download."""
+        return self.mime in LOSSY_MIME_TYPES
+
+    def __repr__(self):
+        return f"ImageRef({self.url!r}, mime={self.mime!r}, sha256={self.sha256!r}, dim={self.dim!r})"
+
+def parse_imeta(tags):
+    """
+    Read NIP-92 imeta tags, e.g. ["imeta", "url https://...", "m image/png", "x <sha256>", "dim 640x480"].
+
+    :param tags: Event tags as lists of strings
+    :return: dict of URL to ImageRef, non-image media is left out
+    """
+    images = {}
+    for tag in tags:
+        if not tag or tag[0] != "imeta":
+            continue
+        fields = {}
+        for entry in tag[1:]:
+            key, _, value = entry.partition(" ")
+            fields.setdefault(key, value.strip())
+        url = fields.get("url")
+        mime = fields.get("m", "").lower() or None
+        if not url or (mime and not mime.startswith("image/")):
+            continue
+        sha256 = fields.get("x", "").lower()
+        images.setdefault(url, ImageRef(url, mime, sha256 if len(sha256) == 64 else None, fields.get("dim")))
+    return images
+
+def extract_images(text, tags=()):
+    """
+    Every image a note links, in the order they appear in its text.
+
+    imeta entries bring their MIME type and hash along and also cover URLs
+    without an image extension (e.g. blossom links). Images only named in a
+    tag come last.
+
+    :param text: Note content
+    :param tags: Note tags as lists of strings
+    :return: list of ImageRef without repeated URLs
+    """
+    found = {}
+    covered = []
+    for url, image in parse_imeta(tags).items():
+        start = text.find(url)
+        if start >= 0:
+            covered.append((start, start + len(url)))
+        found[url] = (start if start >= 0 else len(text), image)
+    for match in IMAGE_URL.finditer(text):
+        url = match.group(0)
+        if url in found or any(start <= match.start() < end for start, end in covered):
+            continue
+        found[url] = (match.start(), ImageRef(url))
+    return [image for _, image in sorted(found.values(), key=lambda item: item[0])]
+
 def extract_image_url(text):
-    # Regex pattern to match .png and .jpg URLs
-    pattern = r'https?://[^\s]+(?:\.png|\.jpe?g)'
-    
-    match = re.search(pattern, text)
+    """First image URL in text, or None."""
+    match = IMAGE_URL.search(text)
     return match.group(0) if match else None
 
 # def extract_image_url(text):
@@ -0,0 +1,249 @@
+import os, sys, time, threading, logging
+from collections import Counter as StackCounter
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+METRICS_PORT = int(os.environ.get("metrics_port", 9108))  # 0 disables the endpoint
+METRICS_HOST = os.environ.get("metrics_host", "127.0.0.1")
+PROFILE_INTERVAL = float(os.environ.get("profile_interval", 0))  # seconds between samples, 0 is off
+
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escape = lambda value: str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    pairs = ",".join(f'{key}="{escape(value)}"' for key, value in labels)
+    return "{" + pairs + "}"
+
+def _format_value(value):
+    return repr(float(value)) if value != float("inf") else "+Inf"
+
+class Counter:
+    """Monotonic counter, one series per label set."""
+    kind = "counter"
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, labels, value) for labels, value in self._values.items()]
+
+class Histogram:
+    """Cumulative bucket histogram, one series per label set."""
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets=STAGE_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        out = []
+        with self._lock:
+            for labels, (counts, total, count) in self._series.items():
+                cumulative = 0
+                for bound, bucket in zip(self.buckets, counts):
+                    cumulative += bucket
+                    out.append((f"{self.name}_bucket", labels + (("le", _format_value(bound)),), cumulative))
+                out.append((f"{self.name}_sum", labels, total))
+                out.append((f"{self.name}_count", labels, count))
+        return out
+
+class Gauge:
+    """
+    Value read at scrape time.
+
+    :param func: Returns a number, or a list of (labels dict, number)
+    """
+    kind = "gauge"
+
+    def __init__(self, name, help, func):
+        self.name = name
+        self.help = help
+        self.func = func
+
+    def samples(self):
+        value = self.func()
+        if isinstance(value, list):
+            return [(self.name, tuple(sorted(labels.items())), v) for labels, v in value]
+        return [(self.name, (), value)]
+
+class Registry:
+    """Named metrics rendered in the Prometheus text exposition format."""
+    def __init__(self):
+        self._metrics = {}
+
+    def _add(self, metric):
+        return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help):
+        return self._add(Counter(name, help))
+
+    def histogram(self, name, help, buckets=STAGE_BUCKETS):
+        return self._add(Histogram(name, help, buckets))
+
+    def gauge(self, name, help, func):
+        # Re-registering replaces the callback, e.g. after a restart of the pool
+        self._metrics[name] = Gauge(name, help, func)
+        return self._metrics[name]
+
+    def render(self):
+        lines = []
+        for metric in list(self._metrics.values()):
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                logging.error(f"Metric {metric.name} failed: {str(e)}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in samples:
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+stage_seconds = registry.histogram("stegbot_stage_seconds", "Time spent in each processing stage")
+
+# Worker processes collect their stage timings here and ship them back with
+# the job result, see collect_stages()
+_collector = None
+
+def observe_stage(name, seconds):
+    if _collector is not None:
+        _collector.append((name, seconds))
+    else:
+        stage_seconds.observe(seconds, stage=name)
+
+@contextmanager
+def stage(name):
+    """Time the enclosed block into stegbot_stage_seconds{stage=name}."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - started)
+
+def collect_stages(func, *args):
+    """
+    Run func in a worker process and capture the stages it timed.
+
+    :return: tuple (func result, list of (stage, seconds))
+    """
+    global _collector
+    _collector = []
+    try:
+        return func(*args), _collector
+    finally:
+        _collector = None
+
+def record_stages(samples):
+    """Record stage timings shipped back from a worker process."""
+    for name, seconds in samples:
+        stage_seconds.observe(seconds, stage=name)
+
+class SamplingProfiler:
+    """
+    Wall clock sampling profiler for the bot process.
+
+    A daemon thread snapshots every other thread's stack each interval
+    seconds and counts them in collapsed form ("a;b;c count"), which
+    flamegraph.pl and speedscope read directly. Decoder worker processes are
+    not sampled, their cost shows up in the stage histogram instead.
+    """
+    def __init__(self, interval):
+        self.interval = interval
+        self.stacks = StackCounter()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="steg-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                with self._lock:
+                    self.stacks[";".join(reversed(stack))] += 1
+
+    def collapsed(self, reset=False):
+        with self._lock:
+            text = "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+            if reset:
+                self.stacks.clear()
+        return text + "\n"
+
+def start_server(port=METRICS_PORT, host=METRICS_HOST, profiler=None):
+    """
+    Serve /metrics (and /profile when a profiler is given) from a daemon thread.
+
+    :return: the HTTP server, or None if port is 0
+    """
+    if not port:
+        return None
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlsplit(self.path)
+            if url.path == "/metrics":
+                body = registry.render().encode()
+                content_type = "text/plain; version=0.0.4; charset=utf-8"
+            elif url.path == "/profile" and profiler is not None:
+                body = profiler.collapsed(reset="reset" in parse_qs(url.query)).encode()
+                content_type = "text/plain; charset=utf-8"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="steg-metrics", daemon=True).start()
+    logging.info(f"Metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
@@ -0,0 +1,113 @@
+import asyncio, logging
+from nostr_sdk import EventId, Filter
+from nostr.pool import pool, LOOKUP_TIMEOUT, HEDGE_DELAY
+
+BATCH_WINDOW = 0.01
+MAX_BATCH = 200
+
+class BatchFetcher:
+    """
+    Micro-batching event lookup by ID.
+
+    get() calls arriving within window seconds of each other are sent as a
+    single Filter().ids([...]) request per relay and the returned events are
+    routed back to their callers. Lookups are hedged: hinted relays and the
+    best ranked relay go first, the rest of the pool is asked for whatever
+    is still missing after hedge_delay seconds. Only copies whose ID and
+    signature verify are returned.
+    """
+    def __init__(self, relay_pool=pool, window=BATCH_WINDOW, max_batch=MAX_BATCH,
+                 timeout=LOOKUP_TIMEOUT, hedge_delay=HEDGE_DELAY):
+        self.pool = relay_pool
+        self.window = window
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self.hedge_delay = hedge_delay
+        self._pending = {}
+        self._hints = set()
+        self._timer = None
+        self._fetches = set()
+
+    async def get(self, event_id, hint=None):
+        """
+        Look up one event by ID.
+
+        :return: Event object or None if no relay had a verified copy
+        """
+        EventId.parse(event_id)  # bad IDs fail here, not inside the batch
+        waiter = self._pending.get(event_id)
+        if waiter is None:
+            waiter = asyncio.get_running_loop().create_future()
+            self._pending[event_id] = waiter
+        if hint:
+            self._hints.add(hint)
+        if len(self._pending) >= self.max_batch:
+            self._flush_now()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._flush_now)
+        return await asyncio.shield(waiter)
+
+    def _flush_now(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, {}
+        hints, self._hints = self._hints, set()
+        if batch:
+            # Keep a reference, the loop only holds tasks weakly
+            task = asyncio.create_task(self._fetch(batch, hints))
+            self._fetches.add(task)
+            task.add_done_callback(self._fetches.discard)
+
+    async def _usable_hint(self, url):
+        # Hints come from untrusted e tags, a malformed URL must not sink the batch
+        try:
+            return await self.pool.ensure_relay(url)
+        except Exception as e:
+            logging.info(f"Skipping relay hint {url}: {e}")
+            return False
+
+    async def _fetch(self, batch, hints):
+        missing = set(batch)
+
+        async def query(url, wanted):
+            f = Filter().ids([EventId.parse(event_id) for event_id in wanted])
+            for event in await self.pool.fetch_from(url, f, self.timeout):
+                event_id = event.id().to_hex()
+                if event_id in missing and event.verify():
+                    missing.discard(event_id)
+                    batch[event_id].set_result(event)
+
+        tasks = set()
+        try:
+            ranked = self.pool.ranked_relays()
+            first = [url for url in hints if await self._usable_hint(url)] or ranked[:1]
+            rest = [url for url in ranked if url not in first]
+
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + self.timeout.total_seconds()
+            hedge_at = loop.time() + self.hedge_delay
+            tasks = {asyncio.create_task(query(url, list(missing))) for url in first}
+            while missing and (tasks or rest):
+                now = loop.time()
+                if now >= deadline:
+                    break
+                if rest and (now >= hedge_at or not tasks):
+                    # Hedge: ask everyone else for what is still missing
+                    tasks |= {asyncio.create_task(query(url, list(missing))) for url in rest}
+                    rest = []
+                    continue
+                until = hedge_at if rest else deadline
+                _, tasks = await asyncio.wait(tasks, timeout=until - now, return_when=asyncio.FIRST_COMPLETED)
+        except Exception as e:
+            logging.error(f"Batched lookup failed: {str(e)}")
+        finally:
+            for task in tasks:
+                task.cancel()
+            # Every waiter gets an answer, None for whatever was not found
+            for waiter in batch.values():
+                if not waiter.done():
+                    waiter.set_result(None)
+
+# Shared instance used by getevent
+batcher = BatchFetcher()
@@ -1,30 +1,22 @@
-import os, json, re, ast
+import json, re
 from datetime import timedelta
-from nostr_sdk import Client, EventId, PublicKey, Kind, Filter, init_logger, LogLevel, Events
+from nostr_sdk import EventId, PublicKey, Kind, Filter, init_logger, LogLevel, Events
+from nostr.pool import pool
+from nostr.batch import batcher
 init_logger(LogLevel.WARN)
 
-# Get relay list
-relay_str = os.environ["relaylist"]
-relaywss_list = ast.literal_eval(relay_str)
-
 # Get event list
 async def getevent(id=None, kind=1, pubkey=None, event=None, since=None, author=None, relay=None):
-    # Initialize client without signer
-    client = Client()
+    # Direct search: batched with other lookups, the relay hint is asked first
+    if id:
+        event = await batcher.get(id, hint=relay)
+        return [json.loads(event.as_json())] if event else []
 
-    # Add relays and connect
-    if relay:
-        await client.add_relay(relay)
-    else:
-        for relay in relaywss_list:
-            await client.add_relay(relay)
-            
-    await client.connect()
+    # Connections come from the shared relay pool, a relay hint narrows the search
+    relays = [relay] if relay else None
 
     # Get events from relays
-    if id: # Direct search
-        f = Filter().id(EventId.parse(id))
-    elif pubkey and kind and since: # Mentions
+    if pubkey and kind and since: # Mentions
         f = Filter().pubkey(PublicKey.from_hex(pubkey)).kind(Kind(kind)).since(since)
     elif event and kind and not pubkey: # Zaps
         f = Filter().event(EventId.parse(event)).kind(Kind(kind))
@@ -40,11 +32,11 @@ async def getevent(id=None, kind=1, pubkey=None, event=None, since=None, author=
     # events = await client.get_events_of([f], source)
     # events = await client.get_events_of([f], timedelta(seconds=10))
 
-    events = await client.fetch_events(f, timedelta(seconds=30))
+    events = await pool.fetch(f, timedelta(seconds=30), relays=relays)
 
     # Convert objects into list of dictionaries
     event_list = []
-    for event in events.to_vec():
+    for event in events:
         event = event.as_json()
         event = json.loads(event)
         event_list.append(event)
@@ -0,0 +1,185 @@
+import asyncio, os, logging
+from nostr_sdk import EventBuilder, Kind, Tag, NostrSigner, nip04_encrypt, gift_wrap
+
+from metrics import registry, stage
+
+OUTBOX_SIZE = int(os.environ.get("outbox_size", 1024))
+OUTBOX_INFLIGHT = int(os.environ.get("outbox_inflight", 16))
+OUTBOX_RETRIES = int(os.environ.get("outbox_retries", 5))
+OUTBOX_BATCH = 32
+RETRY_DELAY = 0.5
+MAX_RETRY_DELAY = 60
+
+NIP04 = "nip04"  # kind 4 encrypted direct message
+NIP17 = "nip17"  # gift wrapped private message
+
+sent_total = registry.counter("stegbot_outbox_sent_total", "Replies accepted by at least one relay")
+retries_total = registry.counter("stegbot_outbox_retries_total", "Reply sends repeated to relays that did not accept them")
+failed_total = registry.counter("stegbot_outbox_failed_total", "Replies given up on, by reason")
+acks_total = registry.counter("stegbot_outbox_acks_total", "Relay answers to reply events, by relay and outcome")
+
+class Reply:
+    """
+    A direct message waiting in the outbox.
+
+    :param receiver: PublicKey of the recipient
+    :param content: Plain text, the outbox encrypts it
+    :param protocol: NIP04 or NIP17
+    :param on_sent: Coroutine function awaited with the Reply once the first relay accepted it
+    """
+    def __init__(self, receiver, content, protocol=NIP04, on_sent=None):
+        self.receiver = receiver
+        self.content = content
+        self.protocol = protocol
+        self.on_sent = on_sent
+        self.event = None
+        self.pending = set()  # relays that have not accepted it and are still being tried
+        self.acked = set()
+        self.attempts = {}  # relay URL -> sends so far
+
+def seal(keys, replies):
+    """NIP-04 encrypt and sign a batch of replies, run in an executor thread."""
+    secret_key = keys.secret_key()
+    for reply in replies:
+        try:
+            encrypted = nip04_encrypt(secret_key, reply.receiver, reply.content)
+            reply.event = EventBuilder(Kind(4), encrypted).tags([Tag.public_key(reply.receiver)]).sign_with_keys(keys)
+        except Exception as e:
+            logging.error(f"Reply encryption failed: {str(e)}")
+
+class Outbox:
+    """
+    Background sender for the bot's direct messages.
+
+    Handlers put() a Reply and carry on, nothing they do waits on a relay.
+    A dispatcher task takes queued replies in batches, encrypts and signs
+    the NIP-04 ones in one executor call, off the event loop, then sends
+    each to every relay on its own. Each relay has at most inflight sends
+    outstanding, so a slow relay only holds up its own sends. Relays that
+    refuse or time out get the same signed event again with exponential
+    backoff, up to retries times each.
+
+    :param client: Connected nostr_sdk Client
+    :param keys: Keys the replies are encrypted and signed with
+    :param size: Replies accepted and not yet finished with before put() refuses more
+    :param inflight: Sends outstanding per relay
+    """
+    def __init__(self, client, keys, size=OUTBOX_SIZE, inflight=OUTBOX_INFLIGHT, retries=OUTBOX_RETRIES):
+        self.client = client
+        self.keys = keys
+        self.size = size
+        self.retries = retries
+        self.queue = asyncio.Queue()
+        self.replies = 0
+        self.inflight = 0
+        self._per_relay = inflight
+        self._lanes = {}
+        self._task = None
+        self._sending = set()
+
+    def start(self):
+        self._task = asyncio.create_task(self._dispatch())
+
+    def qsize(self):
+        return self.queue.qsize()
+
+    def put(self, reply):
+        """
+        Queue a reply without waiting.
+
+        :return: True if the reply was queued, False if the outbox is full
+        """
+        if self.replies >= self.size:
+            logging.error(f"Outbox full ({self.size}), dropping reply")
+            failed_total.inc(reason="full")
+            return False
+        self.replies += 1
+        self.queue.put_nowait(reply)
+        return True
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < OUTBOX_BATCH and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            unsent = list(batch)
+            try:
+                unsealed = [reply for reply in batch if reply.protocol == NIP04]
+                if unsealed:
+                    with stage("nip04_encrypt"):
+                        await loop.run_in_executor(None, seal, self.keys, unsealed)
+                relays = list(await self.client.relays())
+                while unsent:
+                    reply = unsent.pop(0)
+                    try:
+                        if reply.protocol == NIP17:
+                            rumor = EventBuilder.private_msg_rumor(reply.receiver, reply.content).build(self.keys.public_key())
+                            reply.event = await gift_wrap(NostrSigner.keys(self.keys), reply.receiver, rumor)
+                    except Exception as e:
+                        logging.error(f"Reply gift wrap failed: {str(e)}")
+                    if reply.event is None or not relays:
+                        self._finish(reply, "encrypt" if reply.event is None else "no_relays")
+                        continue
+                    reply.pending = set(relays)
+                    for url in relays:
+                        self._spawn(self._send(reply, url))
+            except Exception as e:
+                # The dispatcher must outlive any one batch, or put() fills up with replies nobody sends
+                logging.error(f"Reply dispatch failed: {str(e)}")
+                for reply in unsent:
+                    self._finish(reply, "error")
+
+    def _spawn(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self._sending.add(task)
+        task.add_done_callback(self._sending.discard)
+
+    async def _send(self, reply, url):
+        lane = self._lanes.setdefault(url, asyncio.Semaphore(self._per_relay))
+        async with lane:
+            self.inflight += 1
+            reply.attempts[url] = reply.attempts.get(url, 0) + 1
+            try:
+                with stage("send_event"):
+                    output = await self.client.send_event_to([url], reply.event)
+                error = None if url in output.success else output.failed.get(url, "no answer")
+            except Exception as e:
+                error = str(e)
+            finally:
+                self.inflight -= 1
+
+        if error is None:
+            acks_total.inc(relay=url, outcome="ok")
+            first = not reply.acked
+            reply.acked.add(url)
+            if first:
+                sent_total.inc()
+                if reply.on_sent:
+                    try:
+                        await reply.on_sent(reply)
+                    except Exception as e:
+                        logging.error(f"Reply sent handler failed: {str(e)}")
+        else:
+            acks_total.inc(relay=url, outcome="failed")
+            logging.info(f"Relay {url} did not accept reply: {error}")
+            if reply.attempts[url] <= self.retries:
+                retries_total.inc()
+                delay = min(RETRY_DELAY * 2 ** (reply.attempts[url] - 1), MAX_RETRY_DELAY)
+                asyncio.get_running_loop().call_later(delay, lambda: self._spawn(self._send(reply, url)))
+                return
+        reply.pending.discard(url)
+        if not reply.pending:
+            self._finish(reply, None if reply.acked else "retries")
+
+    def _finish(self, reply, failure):
+        self.replies -= 1
+        if failure:
+            logging.error(f"Giving up on reply to {reply.receiver.to_hex()}: {failure}")
+            failed_total.inc(reason=failure)
+
+    async def close(self):
+        tasks = [self._task, *self._sending] if self._task else list(self._sending)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,176 @@
+import asyncio, os, ast, time, logging
+from collections import OrderedDict
+from datetime import timedelta
+from nostr_sdk import Client, RelayStatus
+
+# Get relay list
+relay_str = os.environ["relaylist"]
+relaywss_list = ast.literal_eval(relay_str)
+
+CONNECT_TIMEOUT = timedelta(seconds=5)
+MAX_BACKOFF = 300
+MAX_HINT_RELAYS = 32
+LOOKUP_TIMEOUT = timedelta(seconds=10)
+HEDGE_DELAY = 0.25
+
+class RelayHealth:
+    """Rolling health record for one relay."""
+    def __init__(self, url):
+        self.url = url
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.last_error = None
+        self.latency = None
+        self.retry_at = 0.0
+
+    @property
+    def healthy(self):
+        return time.monotonic() >= self.retry_at
+
+    def record_success(self, latency):
+        self.successes += 1
+        self.consecutive_failures = 0
+        self.retry_at = 0.0
+        # Exponential moving average of round-trip time
+        self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+
+    def record_failure(self, error):
+        self.failures += 1
+        self.consecutive_failures += 1
+        self.last_error = str(error)
+        self.retry_at = time.monotonic() + min(2 ** self.consecutive_failures, MAX_BACKOFF)
+
+class RelayPool:
+    """
+    Long-lived relay connections shared by getevent and nostrpost.
+
+    The underlying Client is created and connected once, relays that drop
+    are reconnected before use, and each relay keeps a health record so
+    failing relays are skipped with exponential backoff.
+
+    Relays outside the configured list, i.e. hints from untrusted e tags,
+    are only read from and only kept for the MAX_HINT_RELAYS most recently
+    used, older ones are disconnected and forgotten. Events are only ever
+    published to the configured relays.
+    """
+    def __init__(self, relays=None):
+        self.relays = list(relays or relaywss_list)
+        self.health = {url: RelayHealth(url) for url in self.relays}
+        self._hints = OrderedDict()  # hint relay URLs, least recently used first
+        self._client = None
+        self._lock = asyncio.Lock()
+
+    async def client(self):
+        """Return the connected Client, connecting on first use."""
+        if self._client is None:
+            async with self._lock:
+                if self._client is None:
+                    client = Client()
+                    for relay in self.relays:
+                        await client.add_relay(relay)
+                    await client.connect()
+                    await client.wait_for_connection(CONNECT_TIMEOUT)
+                    self._client = client
+        return self._client
+
+    async def ensure_relay(self, url):
+        """
+        Add a relay (e.g. a relay hint) to the pool and make sure it is connected.
+
+        :return: False if a new relay could not be connected, it is dropped again
+        """
+        client = await self.client()
+        if url in self._hints:
+            self._hints.move_to_end(url)
+        elif url not in self.health:
+            if len(self._hints) >= MAX_HINT_RELAYS:
+                await self._drop_hint(client, next(iter(self._hints)))
+            await client.add_read_relay(url)
+            self._hints[url] = None
+            self.health[url] = RelayHealth(url)
+        relay = await client.relay(url)
+        status = relay.status()
+        if status in (RelayStatus.INITIALIZED, RelayStatus.PENDING):
+            # New relay, connect now so the lookup that brought it can use it
+            try:
+                await relay.try_connect(CONNECT_TIMEOUT)
+            except Exception as e:
+                logging.info(f"Relay {url} unreachable: {e}")
+                if url in self._hints:
+                    await self._drop_hint(client, url)
+                return False
+        elif status in (RelayStatus.DISCONNECTED, RelayStatus.TERMINATED):
+            await client.connect_relay(url)
+        return True
+
+    async def _drop_hint(self, client, url):
+        del self._hints[url]
+        self.health.pop(url, None)
+        try:
+            await client.force_remove_relay(url)
+        except Exception as e:
+            logging.info(f"Removing relay hint {url} failed: {e}")
+
+    def ranked_relays(self, relays=None):
+        """Relays ordered by health and latency, relays in backoff last."""
+        def rank(url):
+            health = self.health.get(url)
+            if health is None:
+                return (0, 0.0)
+            return (0 if health.healthy else 1, health.latency or 0.0)
+        return sorted(relays or self.relays, key=rank)
+
+    async def fetch_from(self, url, f, timeout):
+        """
+        Fetch events from a single relay and update its health record.
+
+        :return: list of Event objects
+        """
+        client = await self.client()
+        # A hint dropped while this fetch was queued gets a throwaway record
+        health = self.health.get(url) or RelayHealth(url)
+        started = time.monotonic()
+        try:
+            # fetch_events_from quietly returns nothing for a dropped relay
+            if not (await client.relay(url)).is_connected():
+                raise ConnectionError("relay not connected")
+            events = await client.fetch_events_from([url], f, timeout)
+        except Exception as e:
+            health.record_failure(e)
+            logging.info(f"Relay fetch failed on {url}: {e}")
+            return []
+        health.record_success(time.monotonic() - started)
+        return events.to_vec()
+
+    async def fetch(self, f, timeout, relays=None):
+        """
+        Fetch events from every healthy relay concurrently, de-duplicated by ID.
+
+        :return: list of Event objects
+        """
+        relays = [url for url in (relays or self.relays) if await self.ensure_relay(url)]
+        targets = [url for url in relays if self.health[url].healthy] or relays
+        results = await asyncio.gather(*(self.fetch_from(url, f, timeout) for url in targets))
+
+        seen, events = set(), []
+        for batch in results:
+            for event in batch:
+                event_id = event.id().to_hex()
+                if event_id not in seen:
+                    seen.add(event_id)
+                    events.append(event)
+        return events
+
+    async def send_event(self, event):
+        """Publish a signed event to the configured relays, never to relay hints."""
+        client = await self.client()
+        return await client.send_event_to(self.relays, event)
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.disconnect()
+            self._client = None
+
+# Shared instance used by getevent and nostrpost
+pool = RelayPool()
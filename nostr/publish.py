@@ -1,27 +1,17 @@
-import asyncio, os, json, ast
+import asyncio, os, json
 from datetime import timedelta
-from nostr_sdk import Keys, Client, NostrSigner, Metadata, HttpData, HttpMethod, EventId, EventBuilder, Filter, init_logger, LogLevel
+from nostr_sdk import Keys, Metadata, HttpData, HttpMethod, EventId, EventBuilder, Filter, init_logger, LogLevel
+from nostr.pool import pool
 init_logger(LogLevel.WARN)
 
-# Get relay list
-relay_str = os.environ["relaylist"]
-relaywss_list = ast.literal_eval(relay_str)
-
 def hex_to_note(target_eventID):
     note = EventId.from_hex(target_eventID).to_bech32()
     return note
 
 # Publish content to nostr
 async def nostrpost(private_key, content, kind=None, reply_to=None, url=None, payload=None, tags=[]):
-    # Initialize with Keys signer
+    # Sign locally, the shared relay pool only carries the events
     keys = Keys.parse(private_key)
-    signer = NostrSigner.keys(keys)
-    client = Client(signer)
-
-    # Add relays and connect
-    for relay in relaywss_list:
-        await client.add_relay(relay)
-    await client.connect()
 
     # Send an event using the Nostr Signer
     if content and reply_to: # Replies
@@ -29,7 +19,7 @@ async def nostrpost(private_key, content, kind=None, reply_to=None, url=None, pa
         f = Filter().id(EventId.parse(reply_to))
         # source = EventSource.relays(timeout=timedelta(seconds=10))
         # reply_to = await client.get_events_of([f], source)
-        reply_to = await client.fetch_events([f], timedelta(seconds=10))
+        reply_to = await pool.fetch(f, timedelta(seconds=10))
         reply_to = reply_to[0]
         builder = EventBuilder.text_note_reply(content=content, reply_to=reply_to)
     elif url and payload: # NIP98
@@ -38,7 +28,7 @@ async def nostrpost(private_key, content, kind=None, reply_to=None, url=None, pa
         builder = EventBuilder.metadata(Metadata.from_json(content))
     else: # Default to Text Note
         builder = EventBuilder.text_note(content=content, tags=tags)
-    await client.send_event_builder(builder)
+    await pool.send_event(builder.sign_with_keys(keys))
 
     # Allow note to send
     await asyncio.sleep(2.0)
@@ -47,7 +37,7 @@ async def nostrpost(private_key, content, kind=None, reply_to=None, url=None, pa
     f = Filter().authors([keys.public_key()]).limit(1)
     # source = EventSource.relays(timedelta(seconds=10))
     # events = await client.get_events_of([f], source)
-    events = await client.fetch_events(f, timedelta(seconds=30))
+    events = await pool.fetch(f, timedelta(seconds=30))
 
     for event in events:
         event = event.as_json()
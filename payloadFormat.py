@@ -0,0 +1,217 @@
+import struct, zlib, lzma
+
+# v2 frame, all integers big-endian:
+#   magic    3 bytes  A7 53 47
+#   version  1 byte   2
+#   n_bits   1 byte   bits per channel the frame was written with
+#   flags    1 byte   low two bits: compression (0 none, 1 zlib, 2 lzma), rest zero
+#   length   4 bytes  stored payload bytes
+#   crc32    4 bytes  of the stored payload bytes
+# The first magic byte read as a legacy bit-length header is over 2.8
+# billion bits, more than any image under PIL's pixel limit can hold, so
+# the two formats never collide.
+#
+# Legacy frames are a 32-bit payload length in bits followed by the raw
+# payload.
+MAGIC = b"\xa7SG"
+VERSION = 2
+LEGACY_HEADER_BYTES = 4
+
+_HEADER = struct.Struct(">3sBBBII")
+HEADER_BYTES = _HEADER.size
+
+COMPRESSION = {"none": 0, "zlib": 1, "lzma": 2}
+COMPRESSION_NAMES = {value: name for name, value in COMPRESSION.items()}
+COMPRESS_MIN_BYTES = 64
+LZMA_MIN_BYTES = 4096
+MAX_UNPACKED_BYTES = 64 * 1024 * 1024
+
+class FrameError(ValueError):
+    """Bytes do not start with a valid payload frame."""
+
+class FrameHeader:
+    def __init__(self, version, n_bits, compression, length, crc):
+        self.version = version
+        self.n_bits = n_bits
+        self.compression = compression
+        self.length = length
+        self.crc = crc
+
+    @property
+    def header_bytes(self):
+        return HEADER_BYTES if self.version == VERSION else LEGACY_HEADER_BYTES
+
+    @property
+    def total_bytes(self):
+        return self.header_bytes + self.length
+
+def compress(payload, compression="auto"):
+    """
+    Compress a payload for storage.
+
+    :param compression: "none", "zlib", "lzma" or "auto" (smallest of the
+        three, only trying compression on payloads worth it)
+    :return: tuple (compression name, stored bytes)
+    """
+    if compression == "auto":
+        best = ("none", payload)
+        if len(payload) >= COMPRESS_MIN_BYTES:
+            candidates = [("zlib", zlib.compress(payload, 9))]
+            if len(payload) >= LZMA_MIN_BYTES:
+                candidates.append(("lzma", lzma.compress(payload, preset=6)))
+            for candidate in candidates:
+                if len(candidate[1]) < len(best[1]):
+                    best = candidate
+        return best
+    if compression == "zlib":
+        return "zlib", zlib.compress(payload, 9)
+    if compression == "lzma":
+        return "lzma", lzma.compress(payload, preset=6)
+    if compression == "none":
+        return "none", payload
+    raise ValueError(f"Unknown compression: {compression}")
+
+def compressor(compression):
+    """
+    Incremental compressor for streamed payloads, None for "none".
+    "auto" needs the whole payload to pick from and is not accepted.
+    """
+    if compression == "zlib":
+        return zlib.compressobj(9)
+    if compression == "lzma":
+        return lzma.LZMACompressor(preset=6)
+    if compression == "none":
+        return None
+    raise ValueError(f"Unsupported streaming compression: {compression}")
+
+def pack_header(n_bits, compression, length, crc):
+    """Build a v2 header for length stored bytes with checksum crc."""
+    return _HEADER.pack(MAGIC, VERSION, n_bits, COMPRESSION[compression], length, crc)
+
+def pack(payload, n_bits, compression="auto"):
+    """
+    Build a v2 frame around payload.
+
+    :return: frame bytes, header followed by the stored payload
+    """
+    name, stored = compress(bytes(payload), compression)
+    return pack_header(n_bits, name, len(stored), zlib.crc32(stored)) + stored
+
+def pack_legacy(payload):
+    """Build a legacy frame: 32-bit bit length and the raw payload."""
+    return (len(payload) * 8).to_bytes(LEGACY_HEADER_BYTES, "big") + bytes(payload)
+
+def is_v2(prefix):
+    return bytes(prefix[:len(MAGIC)]) == MAGIC
+
+def parse_header(prefix, n_bits=None, max_bytes=None):
+    """
+    Parse the frame header at the start of prefix.
+
+    :param prefix: First bytes of the hidden stream, HEADER_BYTES are enough
+        for either version
+    :param n_bits: Bits per channel the stream was read with, checked
+        against the v2 header
+    :param max_bytes: Number of bytes the carrier can hold, frames that do
+        not fit are rejected
+    :return: FrameHeader
+    :raises: FrameError if the header is not valid
+    """
+    if is_v2(prefix):
+        if len(prefix) < HEADER_BYTES:
+            raise FrameError("Image is too small to hold a frame header")
+        _, version, frame_bits, flags, length, crc = _HEADER.unpack_from(bytes(prefix[:HEADER_BYTES]))
+        if version != VERSION:
+            raise FrameError(f"Unsupported frame version: {version}")
+        if flags not in COMPRESSION_NAMES:
+            raise FrameError(f"Invalid frame flags: {flags:#04x}")
+        if n_bits is not None and frame_bits != n_bits:
+            raise FrameError(f"Frame was written with n_bits={frame_bits}, read with n_bits={n_bits}")
+        header = FrameHeader(VERSION, frame_bits, COMPRESSION_NAMES[flags], length, crc)
+    else:
+        if len(prefix) < LEGACY_HEADER_BYTES:
+            raise FrameError("Image is too small to hold a length header")
+        bit_length = int.from_bytes(bytes(prefix[:LEGACY_HEADER_BYTES]), "big")
+        if bit_length % 8:
+            raise FrameError(f"Invalid claimed message length: {bit_length} bits")
+        header = FrameHeader(1, n_bits, "none", bit_length // 8, None)
+    if max_bytes is not None and header.total_bytes > max_bytes:
+        raise FrameError(f"Invalid claimed message length: {header.length * 8} bits")
+    return header
+
+def _decompress(stored, compression, max_bytes):
+    if compression == "zlib":
+        decompressor = zlib.decompressobj()
+        data = decompressor.decompress(stored, max_bytes)
+        if decompressor.unconsumed_tail or not decompressor.eof:
+            raise FrameError("Compressed payload is truncated or too large")
+        return data
+    if compression == "lzma":
+        decompressor = lzma.LZMADecompressor()
+        try:
+            data = decompressor.decompress(stored, max_bytes)
+        except lzma.LZMAError as e:
+            raise FrameError(f"Compressed payload is corrupt: {e}")
+        if not decompressor.eof:
+            raise FrameError("Compressed payload is truncated or too large")
+        return data
+    return stored
+
+def iter_decompress(chunks, compression, max_bytes=MAX_UNPACKED_BYTES, chunk_size=64 * 1024):
+    """
+    Decompress stored payload chunks incrementally.
+
+    :param chunks: Iterable of stored bytes
+    :param chunk_size: Most bytes yielded at a time
+    :return: generator of payload bytes
+    :raises: FrameError on bad compressed data or output over max_bytes
+    """
+    if compression == "none":
+        yield from chunks
+        return
+    decompressor = zlib.decompressobj() if compression == "zlib" else lzma.LZMADecompressor()
+    total = 0
+    for data in chunks:
+        while not decompressor.eof:
+            try:
+                out = decompressor.decompress(data, chunk_size)
+            except (zlib.error, lzma.LZMAError) as e:
+                raise FrameError(f"Compressed payload is corrupt: {e}")
+            total += len(out)
+            if total > max_bytes:
+                raise FrameError("Compressed payload is truncated or too large")
+            if out:
+                yield out
+            # zlib hands back input it had no room for, lzma keeps it internally
+            if compression == "zlib":
+                data = decompressor.unconsumed_tail
+                if not data and len(out) < chunk_size:
+                    break
+            else:
+                data = b""
+                if decompressor.needs_input:
+                    break
+    if not decompressor.eof:
+        raise FrameError("Compressed payload is truncated or too large")
+
+def unpack(frame, header=None, max_bytes=MAX_UNPACKED_BYTES):
+    """
+    Return the payload carried by a complete frame.
+
+    :param frame: Frame bytes, at least header.total_bytes long
+    :param header: FrameHeader from parse_header (parsed from frame if omitted)
+    :param max_bytes: Limit on the decompressed payload size
+    :raises: FrameError on a checksum mismatch or bad compressed data
+    """
+    header = header or parse_header(frame)
+    stored = bytes(frame[header.header_bytes:header.total_bytes])
+    if len(stored) < header.length:
+        raise FrameError("Frame is truncated")
+    if header.version == VERSION:
+        if zlib.crc32(stored) != header.crc:
+            raise FrameError("Payload checksum mismatch")
+        try:
+            return _decompress(stored, header.compression, max_bytes)
+        except zlib.error as e:
+            raise FrameError(f"Compressed payload is corrupt: {e}")
+    return stored
@@ -0,0 +1,213 @@
+import struct, zlib
+import numpy as np
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# Colour type -> bytes per pixel at bit depth 8
+CHANNELS_PER_COLOR_TYPE = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+class UnsupportedPng(ValueError):
+    """Raised when the stream is not a PNG the scanline reader can decode."""
+
+class PngScanlineReader:
+    """
+    Push parser that decodes PNG scanlines as bytes arrive.
+
+    Feed it the file in chunks of any size. Only IDAT data needed to reach
+    rows_wanted rows is decompressed, the rest is held back compressed, so
+    reading the first rows of a large image touches a small fraction of it.
+    Supports non-interlaced 8-bit greyscale, RGB, palette and alpha PNGs.
+    Rows come back as RGB, matching Image.convert("RGB").
+    """
+    def __init__(self, rows_wanted=1):
+        self.rows_wanted = rows_wanted
+        self.width = None
+        self.height = None
+        self.color_type = None
+        self._signature_seen = False
+        self._buffer = bytearray()
+        self._chunk_type = None
+        self._chunk_left = 0
+        self._palette = None
+        self._bpp = None
+        self._stride = None
+        self._zlib = zlib.decompressobj()
+        self._compressed = bytearray()
+        self._raw = bytearray()
+        self._prior = None
+        self._rows = []
+        self.finished = False
+
+    @property
+    def header_ready(self):
+        return self.width is not None
+
+    @property
+    def rows_ready(self):
+        return len(self._rows)
+
+    def want_rows(self, rows):
+        """Raise the number of rows to decode and decode any already buffered data."""
+        self.rows_wanted = max(self.rows_wanted, min(rows, self.height or rows))
+        if self._stride is not None:
+            self._inflate()
+
+    def feed(self, data):
+        """Consume the next bytes of the PNG file."""
+        self._buffer += data
+        if not self._signature_seen:
+            if len(self._buffer) < len(PNG_SIGNATURE):
+                return
+            if bytes(self._buffer[:8]) != PNG_SIGNATURE:
+                raise UnsupportedPng("Not a PNG file")
+            del self._buffer[:8]
+            self._signature_seen = True
+
+        while self._buffer and not self.finished:
+            if self._chunk_type is None:
+                if len(self._buffer) < 8:
+                    return
+                self._chunk_left, self._chunk_type = struct.unpack(">I4s", self._buffer[:8])
+                self._chunk_left += 4  # CRC
+                del self._buffer[:8]
+            if self._chunk_type == b"IDAT":
+                self._feed_idat()
+            elif self._chunk_type in (b"IHDR", b"PLTE"):
+                if len(self._buffer) < self._chunk_left:
+                    return
+                body = bytes(self._buffer[:self._chunk_left - 4])
+                del self._buffer[:self._chunk_left]
+                self._chunk_left = 0
+                if self._chunk_type == b"IHDR":
+                    self._read_ihdr(body)
+                else:
+                    self._palette = np.frombuffer(body, dtype=np.uint8).reshape(-1, 3)
+            elif self._chunk_type == b"IEND":
+                self.finished = True
+                return
+            else:
+                # Skip ancillary chunks without buffering them
+                skipped = min(len(self._buffer), self._chunk_left)
+                del self._buffer[:skipped]
+                self._chunk_left -= skipped
+            if self._chunk_left == 0:
+                self._chunk_type = None
+
+    def _read_ihdr(self, body):
+        width, height, depth, color_type, _, _, interlace = struct.unpack(">IIBBBBB", body)
+        if depth != 8 or color_type not in CHANNELS_PER_COLOR_TYPE or interlace:
+            raise UnsupportedPng(f"Unsupported PNG layout: depth {depth}, colour type {color_type}, interlace {interlace}")
+        self.width, self.height, self.color_type = width, height, color_type
+        self._bpp = CHANNELS_PER_COLOR_TYPE[color_type]
+        self._stride = width * self._bpp
+        self._prior = np.zeros(self._stride, dtype=np.uint8)
+        self.rows_wanted = min(self.rows_wanted, height)
+
+    def _feed_idat(self):
+        if self._stride is None:
+            raise UnsupportedPng("IDAT before IHDR")
+        take = min(len(self._buffer), self._chunk_left)
+        data_end = min(take, max(self._chunk_left - 4, 0))
+        self._compressed += self._buffer[:data_end]
+        del self._buffer[:take]
+        self._chunk_left -= take
+        self._inflate()
+
+    def _inflate(self):
+        while self._compressed and len(self._rows) < self.rows_wanted:
+            needed = (self.rows_wanted - len(self._rows)) * (self._stride + 1) - len(self._raw)
+            self._raw += self._zlib.decompress(bytes(self._compressed), max(needed, 1))
+            self._compressed = bytearray(self._zlib.unconsumed_tail)
+            self._unfilter_rows()
+            if self._zlib.eof:
+                self._compressed.clear()
+
+    def _unfilter_rows(self):
+        row_size = self._stride + 1
+        while len(self._raw) >= row_size and len(self._rows) < self.rows_wanted:
+            filter_type = self._raw[0]
+            row = np.frombuffer(bytes(self._raw[1:row_size]), dtype=np.uint8)
+            del self._raw[:row_size]
+            self._prior = unfilter_scanline(filter_type, row, self._prior, self._bpp)
+            self._rows.append(self._prior)
+
+    def rows(self, count=None):
+        """Return the first count decoded rows as an (count, W, 3) RGB array."""
+        rows = self._rows[:count]
+        raw = np.stack(rows).reshape(len(rows), self.width, self._bpp)
+        if self.color_type == 2:
+            return raw
+        if self.color_type == 6:
+            return raw[..., :3]
+        if self.color_type == 3:
+            if self._palette is None:
+                raise UnsupportedPng("Palette image without PLTE")
+            palette = np.zeros((256, 3), dtype=np.uint8)
+            palette[:len(self._palette)] = self._palette
+            return palette[raw[..., 0]]
+        # Greyscale, with or without alpha
+        return np.broadcast_to(raw[..., :1], raw.shape[:2] + (3,))
+
+def unfilter_scanline(filter_type, row, prior, bpp):
+    """
+    Reverse the PNG filter of one scanline (filter byte removed).
+
+    None, Sub and Up are NumPy operations. Average and Paeth need each
+    byte's decoded left neighbour, which no array operation can express,
+    so they run a Python loop per byte: roughly 0.4 and 0.7 ms for a 1024
+    pixel RGB row, against 0.01 ms for Sub. See the unfilter cases in
+    bench/micro.py.
+    """
+    if filter_type == 0:
+        return row
+    if filter_type == 1 or (filter_type == 4 and not prior.any()):
+        # Sub: running sum per channel, uint8 arithmetic wraps like the spec.
+        # Paeth over a zero row (the first one) always picks the left byte, which is Sub.
+        return np.cumsum(row.reshape(-1, bpp), axis=0, dtype=np.uint8).reshape(-1)
+    if filter_type == 2:
+        return row + prior
+    if filter_type == 3:
+        return _unfilter_lanes(_average, row, prior, bpp)
+    if filter_type == 4:
+        return _unfilter_lanes(_paeth, row, prior, bpp)
+    raise UnsupportedPng(f"Unknown PNG filter type {filter_type}")
+
+def _unfilter_lanes(lane_filter, row, prior, bpp):
+    # Each channel only depends on itself, decode them one strided lane at a time
+    raw, up = row.tobytes(), prior.tobytes()
+    out = bytearray(len(raw))
+    for channel in range(bpp):
+        out[channel::bpp] = lane_filter(raw[channel::bpp], up[channel::bpp])
+    return np.frombuffer(bytes(out), dtype=np.uint8)
+
+def _average(raw, up):
+    lane = []
+    left = 0
+    for x, b in zip(raw, up):
+        left = (x + ((left + b) >> 1)) & 0xFF
+        lane.append(left)
+    return bytes(lane)
+
+def _paeth(raw, up):
+    lane = []
+    a = c = 0
+    for x, b in zip(raw, up):
+        # |p - a|, |p - b|, |p - c| for p = a + b - c, abs() is a call and slower
+        pa = b - c
+        pb = a - c
+        pc = pa + pb
+        if pa < 0:
+            pa = -pa
+        if pb < 0:
+            pb = -pb
+        if pc < 0:
+            pc = -pc
+        if pa <= pb and pa <= pc:
+            a = (x + a) & 0xFF
+        elif pb <= pc:
+            a = (x + b) & 0xFF
+        else:
+            a = (x + c) & 0xFF
+        c = b
+        lane.append(a)
+    return bytes(lane)
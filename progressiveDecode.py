@@ -0,0 +1,187 @@
+from PIL import Image
+from io import BytesIO
+
+import lsbEngine
+import payloadFormat
+import imageFormat
+from metrics import stage
+from pngStream import PngScanlineReader, UnsupportedPng
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+class ProgressiveDecoder:
+    """
+    Incremental LSB text decoder fed with raw image file bytes.
+
+    The first bytes are sniffed and files that cannot hold a payload (JPEG,
+    lossy WebP, HEIF, ...) are rejected before anything is
+    decoded. PNGs are decoded scanline by scanline: the frame header is
+    read from the first rows, which tells how many rows hold the payload,
+    and nothing past those rows is decompressed. Other formats are buffered
+    and decoded in full by PIL when finish() is called. Images with more than
+    max_pixels pixels are rejected from their header, before any pixel data
+    is inflated.
+
+    Without n_bits the depth is detected from the header rows. With a
+    prefilter threshold, legacy frames are screened by steganalysis of
+    their first rows before the rest of their region is inflated.
+
+    Usage:
+        decoder = ProgressiveDecoder()
+        for chunk in chunks:
+            if decoder.feed(chunk):
+                break
+        payload = decoder.finish()
+    """
+    def __init__(self, n_bits=None, max_pixels=Image.MAX_IMAGE_PIXELS, prefilter=None):
+        self.n_bits = n_bits
+        self.max_pixels = max_pixels
+        self.prefilter = prefilter
+        self.payload = None
+        self.format = None
+        self._sniff = bytearray()
+        self._png = PngScanlineReader()
+        self._head = bytearray()
+        self._fallback = None
+        self._candidates = None
+        self._screened = False
+
+    @property
+    def done(self):
+        return self.payload is not None
+
+    def feed(self, data):
+        """
+        Consume the next bytes of the image file.
+
+        :return: True once the payload has been decoded and no more input is needed
+        :raises: ValueError if the image cannot hold a valid payload
+        """
+        if self.done:
+            return True
+        if self.format is None:
+            self._sniff += data
+            self.format = imageFormat.sniff(self._sniff)
+            if self.format is None:
+                return False
+            data, self._sniff = bytes(self._sniff), None
+        return self._consume(data)
+
+    def _consume(self, data):
+        if self._fallback is not None:
+            self._fallback += data
+            return False
+        if not self._png.header_ready:
+            self._head += data
+        try:
+            self._png.feed(data)
+        except UnsupportedPng:
+            if self._head is None:
+                raise
+            # Not a PNG the scanline reader handles, let PIL decode it later
+            self._fallback = self._head
+            self._head = None
+            return False
+        if self._png.header_ready:
+            if self._head is not None:
+                self._head = None
+                self._check_size(self._png.width, self._png.height)
+            self._advance()
+        return self.done
+
+    def _check_size(self, width, height):
+        if self.max_pixels and width * height > self.max_pixels:
+            raise ValueError(f"Image has {width * height} pixels, over the {self.max_pixels} pixel limit")
+
+    def _rows_for_bits(self, bit_count, n_bits):
+        return lsbEngine.rows_for_bits(bit_count, n_bits, self._png.width)
+
+    def _advance(self):
+        png = self._png
+        if self._candidates is None:
+            # Enough rows to size a frame of either version at any depth, non-stego images stop here
+            header_rows = min(self._rows_for_bits(lsbEngine.FRAME_PREFIX_BITS, self.n_bits or 1), png.height)
+            png.want_rows(header_rows)
+            if png.rows_ready < header_rows:
+                return
+            rows = png.rows(header_rows)
+            if self.n_bits:
+                prefix = lsbEngine.read_prefix(rows, self.n_bits, payloadFormat.HEADER_BYTES)
+                max_bytes = png.width * png.height * 3 * self.n_bits // 8
+                self._candidates = [(self.n_bits, payloadFormat.parse_header(prefix, self.n_bits, max_bytes))]
+            else:
+                self._candidates = lsbEngine.frame_candidates(rows, pixel_count=png.width * png.height)
+                if not self._candidates:
+                    raise ValueError("No plausible message header at any n_bits")
+
+        # Try each plausible depth in turn, only reading the rows it needs
+        while self._candidates:
+            n_bits, header = self._candidates[0]
+            if self.prefilter is not None and not self._screened:
+                span = lsbEngine.prefilter_span(n_bits, header)
+                if span:
+                    check_rows = self._rows_for_bits(span * n_bits, n_bits)
+                    png.want_rows(check_rows)
+                    if png.rows_ready < check_rows:
+                        return
+                    if not lsbEngine.looks_embedded(png.rows(check_rows), n_bits, header, self.prefilter):
+                        self._next_candidate(ValueError("LSB statistics suggest no hidden data"))
+                        continue
+                self._screened = True
+            payload_rows = self._rows_for_bits(header.total_bytes * 8, n_bits)
+            png.want_rows(payload_rows)
+            if png.rows_ready < payload_rows:
+                return
+            try:
+                self.payload = lsbEngine.decode_frame(png.rows(payload_rows), n_bits, header,
+                                                      require_text=self.n_bits is None)
+                return
+            except ValueError as e:
+                self._next_candidate(e)
+
+    def _next_candidate(self, error):
+        if len(self._candidates) == 1:
+            raise error
+        self._candidates.pop(0)
+        self._screened = False
+
+    def finish(self):
+        """
+        Signal the end of input and return the decoded payload bytes.
+
+        :raises: ValueError if the image ended before the payload or holds no valid payload
+        """
+        if self.done:
+            return self.payload
+        if self.format is None:
+            # File shorter than the sniffing window
+            head, self._sniff = bytes(self._sniff), None
+            self.format = imageFormat.sniff(head, complete=True)
+            if self._consume(head):
+                return self.payload
+        if self._fallback is not None:
+            with stage("pil_decode"):
+                image = Image.open(BytesIO(self._fallback))
+                self._fallback = None
+                self._check_size(*image.size)
+                image.load()
+            self.payload = lsbEngine.decode_image(image, self.n_bits, prefilter=self.prefilter)
+            return self.payload
+        raise ValueError("Image data ended before the hidden message")
+
+def decode_stream(stream, n_bits=None, chunk_size=DEFAULT_CHUNK_SIZE, prefilter=None):
+    """
+    Decode hidden bytes from a file-like object, reading only as much as needed.
+
+    :param stream: Binary file-like object positioned at the start of the image
+    :param n_bits: Number of least significant bits used (default: detect)
+    :param chunk_size: Bytes read per step
+    :param prefilter: Steganalysis confidence threshold, see ProgressiveDecoder
+    :return: Decoded payload bytes
+    """
+    decoder = ProgressiveDecoder(n_bits, prefilter=prefilter)
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk or decoder.feed(chunk):
+            break
+    return decoder.finish()
@@ -0,0 +1,150 @@
+import os, sqlite3, time, logging
+
+import emojiCodec
+from lsbSteganography import extract_images
+from workerPool import DecodeJob, lsb_job
+from eventDedup import SeenEvents
+from metrics import registry
+
+SCAN_FIREHOSE = os.environ.get("scan_firehose", "0").lower() not in ("", "0", "false", "no")
+FINDINGS_PATH = os.environ.get("findings_path", "data/findings.sqlite3")
+FIREHOSE_SUBSCRIPTION = "steg-firehose"
+
+# A lone selector is ordinary emoji presentation (e.g. the red heart), not a payload
+SCAN_MIN_SELECTORS = 2
+# Share of the decode queue scanner jobs may fill, the rest stays free for mentions
+SCAN_QUEUE_SHARE = 0.5
+
+notes_total = registry.counter("stegbot_scan_notes_total", "Firehose notes screened")
+candidates_total = registry.counter("stegbot_scan_candidates_total", "Firehose payload candidates, by kind")
+findings_total = registry.counter("stegbot_scan_findings_total", "Hidden payloads found in the firehose, by kind")
+skipped_total = registry.counter("stegbot_scan_skipped_total", "Firehose images not decoded because the queue was busy")
+
+def screen(content, tags=()):
+    """
+    First look at a note: selector runs and image links, nothing else.
+
+    ASCII-only notes cannot hold selectors and notes without "://" cannot
+    link an image, so most notes stop after those two scans, both done in C.
+
+    :param tags: Note tags, for imeta
+    :return: tuple (list of emojiCodec.Span, list of lsbSteganography.ImageRef)
+    """
+    spans = [] if content.isascii() else emojiCodec.spans(content, SCAN_MIN_SELECTORS)
+    images = extract_images(content, tags) if "://" in content else []
+    return spans, images
+
+class FindingsIndex:
+    """
+    Local SQLite index of hidden payloads found by the scanner.
+
+    One row per (event, source), where source is the image URL or the
+    selector span "emoji:<start>-<end>". Writes of the same finding are
+    idempotent.
+    """
+    def __init__(self, path=FINDINGS_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS findings ("
+            "event_id TEXT NOT NULL, source TEXT NOT NULL, kind TEXT NOT NULL, author TEXT, "
+            "created_at INTEGER, payload TEXT, found_at INTEGER NOT NULL, "
+            "PRIMARY KEY (event_id, source))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS findings_found_at ON findings (found_at)")
+        self._db.commit()
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM findings").fetchone()[0]
+
+    def add(self, event_id, kind, source, payload, author=None, created_at=None):
+        self._db.execute(
+            "INSERT OR REPLACE INTO findings (event_id, source, kind, author, created_at, payload, found_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (event_id, source, kind, author, created_at, payload, int(time.time())),
+        )
+        self._db.commit()
+
+    def recent(self, limit=100):
+        """:return: list of dicts, newest first"""
+        rows = self._db.execute(
+            "SELECT event_id, source, kind, author, created_at, payload, found_at "
+            "FROM findings ORDER BY found_at DESC LIMIT ?", (limit,)
+        ).fetchall()
+        columns = ("event_id", "source", "kind", "author", "created_at", "payload", "found_at")
+        return [dict(zip(columns, row)) for row in rows]
+
+    def close(self):
+        self._db.close()
+
+class Scanner:
+    """
+    Screens a broad stream of notes for hidden payloads.
+
+    Selector payloads are decoded inline, that costs microseconds. Image
+    links go to the decode pool at low priority: only while the queue is
+    under SCAN_QUEUE_SHARE full, so mentions keep their room, only on a
+    decode cache miss and never for images declared as JPEG. Findings are written to a FindingsIndex.
+
+    :param decode_pool: workerPool.DecodePool shared with the mention path
+    :param decode_cache: decodeCache.DecodeCache shared with the mention path
+    :param index: FindingsIndex
+    """
+    def __init__(self, decode_pool, decode_cache, index, queue_share=SCAN_QUEUE_SHARE):
+        self.decode_pool = decode_pool
+        self.decode_cache = decode_cache
+        self.index = index
+        self.queue_limit = max(1, int(decode_pool.queue.maxsize * queue_share))
+        self.seen = SeenEvents()
+
+    def handle(self, event_id, author, created_at, content, tags=()):
+        """
+        Screen one note. Never blocks, image decodes finish in the background.
+
+        :param tags: Note tags as lists of strings, only read for notes with links
+
+        :return: number of payload candidates in the note
+        """
+        if not self.seen.add(event_id):
+            return 0
+        notes_total.inc()
+        spans, images = screen(content, tags)
+        for span in spans:
+            candidates_total.inc(kind="emoji")
+            text = span.text()
+            if text:
+                findings_total.inc(kind="emoji")
+                self.index.add(event_id, "emoji", f"emoji:{span.start}-{span.end}", text, author, created_at)
+        for image in images:
+            if image.lossy:
+                continue
+            candidates_total.inc(kind="lsb")
+            self._decode_image(event_id, author, created_at, image)
+        return len(spans) + len(images)
+
+    def _decode_image(self, event_id, author, created_at, image):
+        url = image.url
+        found, cached_text = self.decode_cache.get(url)
+        if found:
+            self._record_lsb(event_id, author, created_at, url, cached_text)
+            return
+        if self.decode_pool.qsize() >= self.queue_limit:
+            skipped_total.inc()
+            return
+
+        async def on_result(decoded_text):
+            # None means the download failed, retry next time
+            if decoded_text is not None:
+                self.decode_cache.put(url, decoded_text)
+            self._record_lsb(event_id, author, created_at, url, decoded_text)
+
+        self.decode_pool.submit(DecodeJob(lsb_job, (url,), on_result, url=url))
+
+    def _record_lsb(self, event_id, author, created_at, url, decoded_text):
+        if decoded_text:
+            findings_total.inc(kind="lsb")
+            logging.info(f"Firehose finding in {event_id}: {url}")
+            self.index.add(event_id, "lsb", url, decoded_text, author, created_at)
@@ -0,0 +1,137 @@
+import math, os
+import numpy as np
+
+PREFILTER_THRESHOLD = float(os.environ.get("prefilter_threshold", 0.25))
+MAX_SAMPLE = 64 * 1024  # channel values looked at per statistic
+RS_MASK = np.array([0, 1, 1, 0], dtype=bool)
+
+class Analysis:
+    """
+    Outcome of stego_confidence().
+
+    :param confidence: 0 (clean) to 1 (LSB embedding detected)
+    :param chi_square_p: Probability from the pairs-of-values chi-square test
+    :param rs_rate: RS estimate of the share of pixels carrying data
+    """
+    def __init__(self, confidence, chi_square_p, rs_rate):
+        self.confidence = confidence
+        self.chi_square_p = chi_square_p
+        self.rs_rate = rs_rate
+
+    def __repr__(self):
+        return f"Analysis(confidence={self.confidence:.3f}, chi_square_p={self.chi_square_p:.3f}, rs_rate={self.rs_rate:.3f})"
+
+def sample(pixels, max_values=MAX_SAMPLE):
+    """
+    Strided view of an (H, W, C) array holding about max_values channel values.
+    Rows are skipped, never columns, so horizontal neighbours stay adjacent.
+    """
+    step = max(1, -(-pixels.size // max_values))
+    return pixels[::step]
+
+def _chi2_sf(statistic, dof):
+    # Wilson-Hilferty approximation of the chi-square survival function
+    if dof <= 0:
+        return 0.0
+    z = ((statistic / dof) ** (1 / 3) - (1 - 2 / (9 * dof))) / math.sqrt(2 / (9 * dof))
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+def chi_square(values):
+    """
+    Westfeld-Pfitzmann pairs-of-values test.
+
+    LSB replacement evens out the counts of 2k and 2k+1, the returned
+    probability is close to 1 when they are as even as random data would
+    make them and close to 0 for an untouched histogram.
+
+    :param values: uint8 array of channel values
+    :return: float probability
+    """
+    counts = np.bincount(np.asarray(values, dtype=np.uint8).reshape(-1), minlength=256).astype(np.float64)
+    even, odd = counts[0::2], counts[1::2]
+    expected = (even + odd) / 2
+    keep = expected >= 5
+    if keep.sum() < 2:
+        return 0.0
+    statistic = float((((even - expected) ** 2)[keep] / expected[keep]).sum())
+    return _chi2_sf(statistic, int(keep.sum()) - 1)
+
+def _regular_singular(groups, flipped):
+    smoothness = np.abs(np.diff(groups, axis=1)).sum(axis=1)
+    changed = np.abs(np.diff(flipped, axis=1)).sum(axis=1)
+    return np.mean(changed > smoothness), np.mean(changed < smoothness)
+
+def _rs_counts(groups):
+    positive = groups.copy()
+    positive[:, RS_MASK] ^= 1
+    negative = groups.copy()
+    # F-1 flips -1<->0, 1<->2, ...
+    negative[:, RS_MASK] = ((negative[:, RS_MASK] + 1) ^ 1) - 1
+    return _regular_singular(groups, positive) + _regular_singular(groups, negative)
+
+def rs_rate(pixels):
+    """
+    Fridrich RS estimate of the LSB embedding rate.
+
+    Pixels are split into horizontal groups of four per channel and the
+    counts of regular and singular groups under the flipping masks are
+    compared before and after flipping every LSB.
+
+    :param pixels: (H, W, C) uint8 array, W of at least 4
+    :return: estimated share of channels carrying data, 0 to 1
+    """
+    width = pixels.shape[1] - pixels.shape[1] % 4
+    if width < 4 or pixels.shape[0] == 0:
+        return 0.0
+    groups = np.moveaxis(pixels[:, :width].astype(np.int16), -1, 1).reshape(-1, 4)
+    rm, sm, rnm, snm = _rs_counts(groups)
+    rm1, sm1, rnm1, snm1 = _rs_counts(groups ^ 1)
+
+    d0, d1 = rm - sm, rm1 - sm1
+    dn0, dn1 = rnm - snm, rnm1 - snm1
+    a, b, c = 2 * (d1 + d0), dn0 - dn1 - d1 - 3 * d0, d0 - dn0
+    if abs(a) < 1e-12:
+        if abs(b) < 1e-12:
+            return 0.0
+        roots = [-c / b]
+    else:
+        disc = b * b - 4 * a * c
+        # Near full embedding d0 and d1 vanish and noise can push the
+        # discriminant below zero. R_M - S_M shrinks to 0 as the rate goes
+        # to 1 while R_-M - S_-M stays put, use their ratio then.
+        if disc < 0:
+            return float(min(max(1 - d0 / dn0, 0.0), 1.0)) if dn0 > 1e-6 else 0.0
+        roots = [(-b + math.sqrt(disc)) / (2 * a), (-b - math.sqrt(disc)) / (2 * a)]
+    # Take the smallest root that maps to a rate in range, noise can put
+    # the other one just outside it
+    rates = [1.0 if abs(z - 0.5) < 1e-12 else z / (z - 0.5) for z in sorted(roots, key=abs)]
+    rate = min(rates, key=lambda rate: max(-rate, rate - 1, 0.0))
+    return float(min(max(rate, 0.0), 1.0))
+
+def _plane_confidence(view):
+    chi = chi_square(view)
+    rate = rs_rate(view)
+    # RS leads, it is reliable on photos. Evened out value pairs only add
+    # weight next to some RS evidence, smooth histograms (e.g. decoded
+    # JPEGs) pass the chi-square test on their own.
+    return Analysis(max(rate, min(chi, 2 * rate)), chi, rate)
+
+def stego_confidence(pixels, max_values=MAX_SAMPLE, n_bits=1):
+    """
+    Score how likely an (H, W, 3) pixel array carries LSB embedded data.
+
+    Runs on a strided sample, so the cost does not grow with image size.
+    Pass only the rows a message would occupy to test that region.
+
+    :param n_bits: Depth the data would be embedded at. Besides the lowest
+        bit plane the highest embedded one is tested, text only randomises
+        some of the planes it is written to.
+    :return: Analysis of the plane that looks most embedded
+    """
+    view = sample(pixels, max_values)
+    best = _plane_confidence(view)
+    if n_bits > 1 and best.confidence < 1:
+        high = _plane_confidence(view >> (n_bits - 1))
+        if high.confidence > best.confidence:
+            best = high
+    return best
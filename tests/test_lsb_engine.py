@@ -0,0 +1,99 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import lsbEngine
+import payloadFormat
+
+TEXT = "This is a super secret message! " * 8
+
+def carrier(width=64, height=48, seed=0):
+    return np.random.default_rng(seed).integers(0, 256, (height, width, 3), dtype=np.uint8)
+
+@pytest.mark.parametrize("version", [payloadFormat.VERSION, 1])
+@pytest.mark.parametrize("n_bits", range(1, 9))
+def test_round_trip(n_bits, version):
+    pixels = lsbEngine.encode_payload(carrier(), TEXT.encode(), n_bits, version=version)
+    assert lsbEngine.decode_payload(pixels, n_bits) == TEXT.encode()
+
+@pytest.mark.parametrize("version", [payloadFormat.VERSION, 1])
+@pytest.mark.parametrize("n_bits", range(1, 9))
+def test_n_bits_detected(n_bits, version):
+    pixels = lsbEngine.encode_payload(carrier(), TEXT.encode(), n_bits, version=version)
+    assert lsbEngine.decode_payload(pixels) == TEXT.encode()
+
+@pytest.mark.parametrize("compression", ["none", "zlib", "lzma"])
+def test_image_round_trip(compression):
+    image = Image.fromarray(carrier(200, 120))
+    lsbEngine.encode_image(image, TEXT.encode(), 2, compression=compression)
+    assert lsbEngine.decode_image(image) == TEXT.encode()
+
+def test_only_touches_low_bits():
+    pixels = carrier()
+    stego = lsbEngine.encode_payload(pixels.copy(), TEXT.encode(), 3)
+    assert np.array_equal(stego >> 3, pixels >> 3)
+
+def test_too_long_for_carrier():
+    with pytest.raises(ValueError, match="too long"):
+        lsbEngine.encode_payload(carrier(8, 8), TEXT.encode(), 1)
+
+def test_corrupted_payload_bits():
+    pixels = lsbEngine.encode_payload(carrier(), TEXT.encode(), 2, compression="none")
+    # Past the header, inside the stored payload
+    pixels[2, 10, 1] ^= 0x01
+    with pytest.raises(ValueError, match="checksum"):
+        lsbEngine.decode_payload(pixels, 2)
+    with pytest.raises(ValueError):
+        lsbEngine.decode_payload(pixels)
+
+@pytest.mark.parametrize("version", [payloadFormat.VERSION, 1])
+def test_declared_length_larger_than_carrier(version):
+    pixels = carrier(16, 16)
+    room = lsbEngine.capacity(pixels, 2) // 8
+    if version == payloadFormat.VERSION:
+        header = payloadFormat.pack_header(2, "none", room, 0)
+    else:
+        header = (room * 8).to_bytes(payloadFormat.LEGACY_HEADER_BYTES, "big")
+    lsbEngine.write_bytes(pixels, 2, 0, header)
+    with pytest.raises(ValueError, match="length"):
+        lsbEngine.decode_payload(pixels, 2)
+
+def test_blank_image_has_no_message():
+    with pytest.raises(ValueError):
+        lsbEngine.decode_payload(np.zeros((48, 64, 3), dtype=np.uint8))
+
+def test_legacy_frame_passes_prefilter():
+    pixels = carrier(256, 256)
+    text = "".join(chr(ord("a") + i % 26) for i in range(4096)).encode()
+    lsbEngine.encode_payload(pixels, text, 2, version=1)
+    assert lsbEngine.decode_payload(pixels, prefilter=0.25) == text
+
+@pytest.mark.parametrize("compression", ["none", "zlib", "lzma"])
+@pytest.mark.parametrize("n_bits", range(1, 9))
+def test_stream_round_trip(n_bits, compression):
+    pixels = carrier(128, 96)
+    payload = np.random.default_rng(1).integers(0, 4, 4000, dtype=np.uint8).tobytes()
+    assert lsbEngine.encode_bytes(pixels, io.BytesIO(payload), n_bits, compression=compression, chunk_size=1000) == len(payload)
+    sink = io.BytesIO()
+    assert lsbEngine.decode_bytes(pixels, sink, chunk_size=777) == len(payload)
+    assert sink.getvalue() == payload
+    assert b"".join(lsbEngine.decode_bytes(pixels, n_bits=n_bits)) == payload
+
+def test_stream_corrupted_crc():
+    pixels = carrier(128, 96)
+    lsbEngine.encode_bytes(pixels, [b"x" * 2000], 2)
+    pixels[20, 5, 0] ^= 0x01
+    with pytest.raises(payloadFormat.FrameError, match="checksum"):
+        lsbEngine.decode_bytes(pixels, n_bits=2)
+
+@pytest.mark.parametrize("n_bits", [None, 2])
+def test_stream_decompressed_size_limit(n_bits):
+    # Unpacks well past what the carrier holds, max_bytes caps the unpacked size only
+    pixels = carrier(40, 40)
+    bomb = bytes(200 * 1024)
+    lsbEngine.encode_bytes(pixels, [bomb], 2, compression="zlib")
+    assert b"".join(lsbEngine.decode_bytes(pixels, n_bits=n_bits)) == bomb
+    with pytest.raises(payloadFormat.FrameError, match="too large"):
+        b"".join(lsbEngine.decode_bytes(pixels, n_bits=n_bits, max_bytes=len(bomb) - 1))
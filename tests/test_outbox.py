@@ -0,0 +1,100 @@
+import asyncio
+
+from nostr_sdk import Keys, SendEventOutput
+
+import nostr.outbox as outbox
+from nostr.outbox import Outbox, Reply, NIP17
+
+RELAYS = ["wss://a.example", "wss://b.example"]
+
+class FakeClient:
+    """
+    Stands in for nostr_sdk.Client. Answers with the binding's own
+    SendEventOutput so the fields the outbox reads are the real ones.
+
+    :param refusals: relay URL -> number of sends it refuses before accepting
+    """
+    def __init__(self, refusals=None, relays=RELAYS):
+        self.refusals = dict(refusals or {})
+        self.urls = relays
+        self.sends = []
+        self.broken = 0
+
+    async def relays(self):
+        if self.broken:
+            self.broken -= 1
+            raise RuntimeError("client not ready")
+        return {url: None for url in self.urls}
+
+    async def send_event_to(self, urls, event):
+        [url] = urls
+        self.sends.append((url, event.id().to_hex()))
+        if self.refusals.get(url, 0) > 0:
+            self.refusals[url] -= 1
+            return SendEventOutput(id=event.id(), success=[], failed={url: "rate-limited"})
+        return SendEventOutput(id=event.id(), success=[url], failed={})
+
+async def drain(box, timeout=5):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while box.replies and loop.time() < deadline:
+        await asyncio.sleep(0.01)
+    assert box.replies == 0
+
+def run(client, replies, **kwargs):
+    keys = Keys.generate()
+    sent = []
+
+    async def on_sent(reply):
+        sent.append(reply.content)
+
+    async def main():
+        box = Outbox(client, keys, **kwargs)
+        box.start()
+        for content, protocol in replies:
+            assert box.put(Reply(Keys.generate().public_key(), content, protocol, on_sent))
+        await drain(box)
+        await box.close()
+    asyncio.run(main())
+    return sent
+
+def test_reply_goes_to_every_relay():
+    client = FakeClient()
+    sent = run(client, [("hi", outbox.NIP04)])
+    assert sent == ["hi"]
+    assert sorted(url for url, _ in client.sends) == RELAYS
+
+def test_gift_wrapped_reply():
+    client = FakeClient()
+    assert run(client, [("secret", NIP17)]) == ["secret"]
+    assert len(client.sends) == 2
+
+def test_refusing_relay_is_retried_with_the_same_event(monkeypatch):
+    monkeypatch.setattr(outbox, "RETRY_DELAY", 0.01)
+    client = FakeClient(refusals={"wss://b.example": 2})
+    assert run(client, [("hi", outbox.NIP04)]) == ["hi"]
+    to_b = [event_id for url, event_id in client.sends if url == "wss://b.example"]
+    assert len(to_b) == 3 and len(set(to_b)) == 1
+
+def test_gives_up_after_retries(monkeypatch):
+    monkeypatch.setattr(outbox, "RETRY_DELAY", 0.01)
+    client = FakeClient(refusals={url: 10 for url in RELAYS})
+    assert run(client, [("hi", outbox.NIP04)], retries=2) == []
+    assert len(client.sends) == 2 * 3
+
+def test_dispatcher_survives_a_failed_batch():
+    client = FakeClient()
+    client.broken = 1
+    keys = Keys.generate()
+
+    async def main():
+        box = Outbox(client, keys)
+        box.start()
+        box.put(Reply(keys.public_key(), "lost"))
+        await drain(box)
+        box.put(Reply(keys.public_key(), "delivered"))
+        await drain(box)
+        assert not box._task.done()
+        await box.close()
+    asyncio.run(main())
+    assert len(client.sends) == 2
@@ -0,0 +1,82 @@
+import zlib
+
+import pytest
+
+import payloadFormat
+from payloadFormat import FrameError
+
+PAYLOAD = ("gm nostr " * 200).encode()
+
+@pytest.mark.parametrize("compression", ["none", "zlib", "lzma", "auto"])
+@pytest.mark.parametrize("n_bits", range(1, 9))
+def test_v2_round_trip(n_bits, compression):
+    frame = payloadFormat.pack(PAYLOAD, n_bits, compression)
+    header = payloadFormat.parse_header(frame, n_bits, len(frame))
+    assert header.version == payloadFormat.VERSION
+    assert header.n_bits == n_bits
+    assert header.total_bytes == len(frame)
+    assert payloadFormat.unpack(frame, header) == PAYLOAD
+
+def test_auto_compression_keeps_small_payloads_plain():
+    assert payloadFormat.compress(b"gm")[0] == "none"
+    assert payloadFormat.compress(PAYLOAD)[0] != "none"
+
+def test_legacy_round_trip():
+    frame = payloadFormat.pack_legacy(PAYLOAD)
+    header = payloadFormat.parse_header(frame, 2)
+    assert header.version == 1
+    assert header.length == len(PAYLOAD)
+    assert payloadFormat.unpack(frame, header) == PAYLOAD
+
+def test_corrupted_crc():
+    frame = bytearray(payloadFormat.pack(PAYLOAD, 2, "none"))
+    frame[-1] ^= 0x01
+    with pytest.raises(FrameError, match="checksum"):
+        payloadFormat.unpack(frame)
+
+def test_corrupted_compressed_payload_with_matching_crc():
+    stored = b"\x78\x9c" + b"\xff" * 16
+    frame = payloadFormat.pack_header(2, "zlib", len(stored), zlib.crc32(stored)) + stored
+    with pytest.raises(FrameError):
+        payloadFormat.unpack(frame)
+
+@pytest.mark.parametrize("frame", [payloadFormat.pack(PAYLOAD, 2, "none"), payloadFormat.pack_legacy(PAYLOAD)])
+def test_declared_length_larger_than_carrier(frame):
+    with pytest.raises(FrameError, match="length"):
+        payloadFormat.parse_header(frame, 2, max_bytes=len(frame) - 1)
+
+def test_legacy_length_not_whole_bytes():
+    with pytest.raises(FrameError):
+        payloadFormat.parse_header((12).to_bytes(4, "big") + b"ab")
+
+def test_n_bits_mismatch():
+    frame = payloadFormat.pack(PAYLOAD, 3, "none")
+    with pytest.raises(FrameError, match="n_bits=3"):
+        payloadFormat.parse_header(frame, 2)
+
+def test_unknown_version_and_flags():
+    frame = bytearray(payloadFormat.pack(PAYLOAD, 2, "none"))
+    frame[3] = 3
+    with pytest.raises(FrameError, match="version"):
+        payloadFormat.parse_header(frame)
+    frame[3] = payloadFormat.VERSION
+    frame[5] = 0x80
+    with pytest.raises(FrameError, match="flags"):
+        payloadFormat.parse_header(frame)
+
+@pytest.mark.parametrize("compression", ["zlib", "lzma"])
+def test_decompressed_size_over_limit(compression):
+    bomb = bytes(1024 * 1024)
+    frame = payloadFormat.pack(bomb, 2, compression)
+    assert len(frame) < 64 * 1024
+    with pytest.raises(FrameError, match="too large"):
+        payloadFormat.unpack(frame, max_bytes=len(bomb) - 1)
+    name, stored = payloadFormat.compress(bomb, compression)
+    with pytest.raises(FrameError, match="too large"):
+        b"".join(payloadFormat.iter_decompress([stored], name, max_bytes=len(bomb) - 1))
+    assert b"".join(payloadFormat.iter_decompress([stored], name, max_bytes=len(bomb))) == bomb
+
+def test_truncated_frame():
+    frame = payloadFormat.pack(PAYLOAD, 2, "none")
+    with pytest.raises(FrameError, match="truncated"):
+        payloadFormat.unpack(frame[:-1], payloadFormat.parse_header(frame))
@@ -0,0 +1,120 @@
+import io, struct, zlib
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import lsbEngine
+import payloadFormat
+from imageFormat import UnsupportedFormat
+from pngStream import PNG_SIGNATURE, PngScanlineReader
+from progressiveDecode import ProgressiveDecoder, decode_stream
+
+TEXT = ("Progressive and full decodes must agree. " * 6).encode()
+
+def carrier(width=96, height=64, seed=0):
+    return np.random.default_rng(seed).integers(0, 256, (height, width, 3), dtype=np.uint8)
+
+def save(pixels, format="PNG", mode="RGB", **params):
+    image = Image.fromarray(pixels)
+    if mode == "RGBA":
+        image.putalpha(255)
+    buffer = io.BytesIO()
+    image.save(buffer, format, **params)
+    return buffer.getvalue()
+
+def full_decode(data, n_bits=None):
+    return lsbEngine.decode_image(Image.open(io.BytesIO(data)), n_bits)
+
+@pytest.mark.parametrize("version", [payloadFormat.VERSION, 1])
+@pytest.mark.parametrize("n_bits", range(1, 9))
+def test_png_matches_full_decode(n_bits, version):
+    data = save(lsbEngine.encode_payload(carrier(), TEXT, n_bits, version=version))
+    for given in (n_bits, None):
+        progressive = decode_stream(io.BytesIO(data), given, chunk_size=257)
+        assert progressive == full_decode(data, given) == TEXT
+
+@pytest.mark.parametrize("format, mode, params", [
+    ("PNG", "RGBA", {}),
+    ("PNG", "RGB", {"compress_level": 0}),
+    ("BMP", "RGB", {}),
+    ("TIFF", "RGB", {}),
+    ("WEBP", "RGB", {"lossless": True}),
+])
+def test_other_layouts_match_full_decode(format, mode, params):
+    data = save(lsbEngine.encode_payload(carrier(), TEXT, 2), format, mode, **params)
+    assert decode_stream(io.BytesIO(data), chunk_size=1000) == full_decode(data) == TEXT
+
+def test_one_byte_at_a_time():
+    data = save(lsbEngine.encode_payload(carrier(), TEXT, 3))
+    decoder = ProgressiveDecoder()
+    for i in range(len(data)):
+        if decoder.feed(data[i:i + 1]):
+            break
+    assert decoder.finish() == TEXT
+
+def test_reads_only_the_rows_it_needs():
+    data = save(lsbEngine.encode_payload(carrier(1000, 1000), b"gm", 2))
+    stream = io.BytesIO(data)
+    assert decode_stream(stream, chunk_size=4096) == b"gm"
+    assert stream.tell() < len(data) // 10
+
+def test_corrupted_payload_matches_full_decode():
+    pixels = lsbEngine.encode_payload(carrier(), TEXT, 2, compression="none")
+    pixels[2, 10, 1] ^= 0x01
+    data = save(pixels)
+    with pytest.raises(ValueError, match="checksum"):
+        decode_stream(io.BytesIO(data), 2)
+    with pytest.raises(ValueError, match="checksum"):
+        full_decode(data, 2)
+
+def test_truncated_file():
+    data = save(lsbEngine.encode_payload(carrier(), TEXT, 2, compression="none"))
+    with pytest.raises(ValueError):
+        decode_stream(io.BytesIO(data[:200]))
+
+def test_lossy_file_rejected_from_its_first_bytes():
+    data = save(carrier(), "JPEG")
+    with pytest.raises(UnsupportedFormat):
+        ProgressiveDecoder().feed(data[:64])
+
+def _forward_filter(filter_type, row, prior, bpp):
+    row, prior = row.astype(np.int32), prior.astype(np.int32)
+    left = np.concatenate([np.zeros(bpp, np.int32), row[:-bpp]])
+    upper_left = np.concatenate([np.zeros(bpp, np.int32), prior[:-bpp]])
+    if filter_type == 0:
+        predictor = np.zeros_like(row)
+    elif filter_type == 1:
+        predictor = left
+    elif filter_type == 2:
+        predictor = prior
+    elif filter_type == 3:
+        predictor = (left + prior) // 2
+    else:
+        p = left + prior - upper_left
+        pa, pb, pc = abs(p - left), abs(p - prior), abs(p - upper_left)
+        predictor = np.where((pa <= pb) & (pa <= pc), left, np.where(pb <= pc, prior, upper_left))
+    return ((row - predictor) % 256).astype(np.uint8)
+
+def _png_chunk(kind, body):
+    return struct.pack(">I", len(body)) + kind + body + struct.pack(">I", zlib.crc32(kind + body))
+
+@pytest.mark.parametrize("color_type, bpp", [(2, 3), (6, 4), (0, 1), (4, 2)])
+def test_every_scanline_filter_matches_pil(color_type, bpp):
+    height, width = 15, 37
+    pixels = np.random.default_rng(color_type).integers(0, 256, (height, width * bpp), dtype=np.uint8)
+    pixels[:3] = pixels[0]  # flat rows give Paeth and Average ties
+    raw, prior = bytearray(), np.zeros(width * bpp, dtype=np.uint8)
+    for y in range(height):
+        filter_type = y % 5
+        raw.append(filter_type)
+        raw += _forward_filter(filter_type, pixels[y], prior, bpp).tobytes()
+        prior = pixels[y]
+    data = (PNG_SIGNATURE + _png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0))
+            + _png_chunk(b"IDAT", zlib.compress(bytes(raw))) + _png_chunk(b"IEND", b""))
+
+    reader = PngScanlineReader(rows_wanted=height)
+    for i in range(0, len(data), 50):
+        reader.feed(data[i:i + 50])
+    expected = np.asarray(Image.open(io.BytesIO(data)).convert("RGB"))
+    assert np.array_equal(reader.rows(), expected)
@@ -0,0 +1,257 @@
+import asyncio, logging, os, time
+import multiprocessing
+import requests
+from collections import deque
+from urllib.parse import urlsplit
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from lsbSteganography import decode_payload_from_url, get_session, FETCH_TIMEOUT
+from steganalysis import PREFILTER_THRESHOLD
+from emojiDecoder import detect_and_decode_emoji_steganography
+from metrics import registry, stage, collect_stages, record_stages, observe_stage
+
+DECODE_WORKERS = int(os.environ.get("decode_workers", os.cpu_count() or 1))
+DECODE_QUEUE_SIZE = int(os.environ.get("decode_queue_size", 64))
+DECODE_OVERFLOW = os.environ.get("decode_overflow", "drop")  # drop or shed_oldest
+# Jobs one host may run at once, 0 for every worker but one
+DECODE_PER_HOST = int(os.environ.get("decode_per_host", 0))
+
+OVERFLOW_POLICIES = ("drop", "shed_oldest")
+
+jobs_total = registry.counter("stegbot_decode_jobs_total", "Decode jobs finished, by job and outcome")
+overflow_total = registry.counter("stegbot_decode_overflow_total", "Decode jobs turned away because the queue was full")
+
+# Worker process entry points, kept at module level so they can be pickled
+def lsb_job(image_url, n_bits=None):
+    """
+    Decode an image URL in a worker process.
+    Returns text, False if there is no message, or None if the download failed
+    or ran past FETCH_TIMEOUT.
+    """
+    try:
+        return decode_payload_from_url(image_url, n_bits, session=get_session(), prefilter=PREFILTER_THRESHOLD,
+                                       deadline=FETCH_TIMEOUT).decode()
+    except requests.RequestException:
+        return None
+    except Exception:
+        return False
+
+def emoji_job(text):
+    """Decode emoji variation selector text in a worker process. Returns text or False."""
+    with stage("emoji_decode"):
+        has_hidden, decoded_text = detect_and_decode_emoji_steganography(text)
+    return decoded_text if has_hidden else False
+
+class DecodeJob:
+    """
+    A unit of work for the pool.
+
+    :param func: Module level function run in a worker process
+    :param args: Arguments for func
+    :param on_result: Coroutine function called with the result in the event loop,
+        None if the job failed before producing one
+    :param on_overflow: Coroutine function called if the job is dropped or shed
+    :param url: URL the job downloads, jobs for the same host share its per-host limit
+    """
+    def __init__(self, func, args, on_result, on_overflow=None, url=None):
+        self.func = func
+        self.args = args
+        self.on_result = on_result
+        self.on_overflow = on_overflow
+        self.url = url
+        self.queued_at = None
+
+# Slot value of a grouped job the pool turned away
+OVERFLOWED = object()
+
+class JobGroup:
+    """
+    Gathers the results of related jobs, e.g. every image in one note.
+
+    Each slot() is filled by a job callback or directly with a result that
+    needed no job. Once close() was called and every slot is filled,
+    on_done is awaited once with the results in slot order.
+
+    :param on_done: Coroutine function taking the list of results
+    """
+    def __init__(self, on_done):
+        self.results = []
+        self._on_done = on_done
+        self._pending = 0
+        self._closed = False
+        self._finished = False
+
+    def slot(self):
+        """
+        Reserve the next result.
+
+        :return: Coroutine function that stores the result
+        """
+        index = len(self.results)
+        self.results.append(None)
+        self._pending += 1
+
+        async def fill(result):
+            self.results[index] = result
+            self._pending -= 1
+            await self._finish()
+        return fill
+
+    def submit(self, pool, func, args, on_result=None, url=None):
+        """
+        Queue a job whose result fills a new slot, OVERFLOWED if it is turned away.
+
+        :param on_result: Coroutine function called with the result before it is stored
+        :param url: URL the job downloads, see DecodeJob
+        :return: True if the job was queued
+        """
+        fill = self.slot()
+
+        async def store(result):
+            try:
+                if on_result:
+                    await on_result(result)
+            finally:
+                await fill(result)
+
+        async def overflowed():
+            await fill(OVERFLOWED)
+
+        return pool.submit(DecodeJob(func, args, store, overflowed, url))
+
+    async def close(self):
+        """No more slots will be taken."""
+        self._closed = True
+        await self._finish()
+
+    async def _finish(self):
+        if self._closed and not self._pending and not self._finished:
+            self._finished = True
+            await self._on_done(self.results)
+
+class DecodePool:
+    """
+    Bounded job queue feeding a pool of decoder processes.
+
+    submit() never blocks the caller. When the queue is full the overflow
+    policy decides who loses: "drop" turns the new job away, "shed_oldest"
+    evicts the job that has waited longest. The losing job's on_overflow
+    callback is awaited so the requester can be told the bot is busy.
+
+    Jobs that name a URL run at most per_host at a time for its host, by
+    default every worker but one, so a slow host can never hold them all.
+    A job whose host is at its limit is set aside and the worker moves on
+    to the next job, other hosts never queue behind it. The set aside job
+    runs as soon as one of its host's jobs finishes.
+    """
+    def __init__(self, workers=DECODE_WORKERS, queue_size=DECODE_QUEUE_SIZE, overflow=DECODE_OVERFLOW,
+                 per_host=DECODE_PER_HOST):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        self.workers = workers
+        self.overflow = overflow
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.per_host = per_host or max(1, workers - 1)
+        self._running = {}  # host -> jobs running
+        self._parked = {}  # host -> deque of jobs waiting for a slot on that host
+        self._executor = None
+        self._tasks = []
+
+    def start(self):
+        self._executor = self._make_executor()
+        self._tasks = [asyncio.create_task(self._consume()) for _ in range(self.workers)]
+
+    def _make_executor(self):
+        # Spawned workers do not inherit the relay client's threads
+        return ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def qsize(self):
+        return self.queue.qsize() + sum(len(jobs) for jobs in self._parked.values())
+
+    def submit(self, job):
+        """
+        Queue a job without waiting.
+
+        :return: True if the job was queued, False if it was dropped
+        """
+        if self.qsize() >= self.queue.maxsize:
+            # Set aside jobs count against the queue size but are not shed
+            if self.overflow == "drop" or self.queue.empty():
+                self._reject(job)
+                return False
+            shed = self.queue.get_nowait()
+            self.queue.task_done()
+            self._reject(shed)
+        job.queued_at = time.perf_counter()
+        self.queue.put_nowait(job)
+        return True
+
+    def _reject(self, job):
+        logging.info(f"Decode queue full ({self.queue.maxsize}), {self.overflow}")
+        overflow_total.inc(policy=self.overflow)
+        if job.on_overflow:
+            asyncio.create_task(job.on_overflow())
+
+    async def _consume(self):
+        while True:
+            job = await self.queue.get()
+            host = urlsplit(job.url).hostname if job.url else None
+            if host and self._running.get(host, 0) >= self.per_host:
+                self._parked.setdefault(host, deque()).append(job)
+                continue
+            while job:
+                await self._run(job, host)
+                job = self._unpark(host)
+
+    def _unpark(self, host):
+        jobs = self._parked.get(host)
+        if not jobs:
+            return None
+        job = jobs.popleft()
+        if not jobs:
+            del self._parked[host]
+        return job
+
+    async def _run(self, job, host):
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        if job.queued_at is not None:
+            observe_stage("queue_wait", started - job.queued_at)
+        if host:
+            self._running[host] = self._running.get(host, 0) + 1
+        executor = self._executor
+        try:
+            # Stages timed inside the worker come back with the result
+            result, stages = await loop.run_in_executor(executor, collect_stages, job.func, *job.args)
+            record_stages(stages)
+        except BrokenProcessPool:
+            if executor is self._executor:
+                logging.error("Decode worker died, restarting pool")
+                self._executor = self._make_executor()
+                executor.shutdown(wait=False)
+            result = None
+        except Exception as e:
+            logging.error(f"Decode job failed: {str(e)}")
+            result = None
+        finally:
+            if host:
+                self._running[host] -= 1
+                if not self._running[host]:
+                    del self._running[host]
+        observe_stage("decode_job", time.perf_counter() - started)
+        outcome = "error" if result is None else ("found" if result else "empty")
+        jobs_total.inc(job=job.func.__name__, outcome=outcome)
+        try:
+            await job.on_result(result)
+        except Exception as e:
+            logging.error(f"Decode result handler failed: {str(e)}")
+        finally:
+            self.queue.task_done()
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)